@@ -1,9 +1,12 @@
 from __future__ import annotations
 import uuid
 from orchestrator.router import Router
-from shared.schemas import JobContext, Item, Choice
+from shared.schemas import JobContext, Item, Choice, Passage
 from shared.gemini import call_gemini_json_async
-from shared.topics import ENGLISH_TOPICS
+from shared.budget import ledger_for
+from shared.executor import approx_size, run_cpu
+from shared.resilience import workload_stage
+from shared.topics import ENGLISH_TOPICS, pick_topic_pair
 import random
 
 # Events
@@ -38,6 +41,37 @@ PROMPT_ITEMS_BASE = (
     " Incorporate this distinct context: {context}."
 )
 
+# Passage-set mode: one longer passage shared by several items (via evidence_ids)
+SYSTEM_PASSAGE = (
+    "You are a Year 6 Reading Comprehension passage writer."
+    " Write original, age-appropriate passages (Lexile 800–1000) with enough detail to support several questions."
+    " Avoid repetitive or overused topics (e.g., bees, honey, pollination)."
+    " Respond ONLY with JSON: {\"title\": str, \"text\": str}."
+)
+
+PROMPT_PASSAGE_BASE = (
+    "Write a {passage_type} passage of 3-4 paragraphs (250-350 words) for Year 6."
+    " Incorporate this distinct context: {context}."
+    " It must support {count} different questions covering: {topics}."
+    " Target difficulty level: {difficulty} (1 easy, 2 medium, 3 hard)."
+)
+
+SYSTEM_SET_ITEMS = (
+    "You are a Year 6 Reading Comprehension item writer."
+    " The passage is provided above; every question must be answerable from it alone."
+    " Create MCQs with 5 options (A-E) and a single correct answer. Do not repeat the passage in the prompt."
+    " Each question must test a different part or skill of the passage."
+    " Respond ONLY with JSON: {\"items\":[{prompt, choices:[{id,text}], answer, solution, tags, difficulty}]}."
+)
+
+PROMPT_SET_ITEMS_BASE = (
+    "Create {count} MCQs about the passage, one per focus in this order: {topics}."
+    " Keep language simple. 5 options per item."
+    " Target difficulty level: {difficulty} (1 easy, 2 medium, 3 hard)."
+)
+
+MAX_ITEMS_PER_PASSAGE = 6
+
 CONTEXTS = [
     "a school science fair",
     "a class trip to the museum",
@@ -50,12 +84,14 @@ CONTEXTS = [
 ]
 
 
-def _coerce_items(raw_items: list[dict]) -> list[Item]:
+def _coerce_items(raw_items: list[dict], limit: int = 1) -> list[Item]:
     items: list[Item] = []
     labels = ["A", "B", "C", "D", "E"]
     if not isinstance(raw_items, list):
         return []
-    for it in raw_items[:1]:
+    for it in raw_items[:limit]:
+        if not isinstance(it, dict):
+            continue
         prompt = it.get("prompt") or ""
         choices = it.get("choices") or []
         labeled: list[Choice] = []
@@ -98,12 +134,70 @@ def _parse_plan(plan_resp: object, topic: str) -> list[dict]:
     ]
 
 
+def _coerce_passage(resp: object) -> Passage | None:
+    if not isinstance(resp, dict):
+        return None
+    text = str(resp.get("text") or resp.get("passage") or "").strip()
+    if not text:
+        return None
+    title = str(resp.get("title") or "").strip()
+    if title:
+        text = f"{title}\n\n{text}"
+    return Passage(id=str(uuid.uuid4()), text=text)
+
+
+def _set_topics(count: int, constraints: dict) -> list[str]:
+    # Lead with the scheduled pair, then spread the remaining skills; repeat only when count exceeds the pool
+    lead = list(pick_topic_pair(constraints, ENGLISH_TOPICS))
+    rest = [t for t in random.sample(ENGLISH_TOPICS, len(ENGLISH_TOPICS)) if t not in lead]
+    pool = lead + rest
+    return [pool[i % len(pool)] for i in range(count)]
+
+
+async def _generate_passage_set(ctx: JobContext, count: int, passage_type: str) -> tuple[Passage | None, list[Item]]:
+    difficulty = int(ctx.constraints.get("difficulty", 2)) if isinstance(ctx.constraints, dict) else 2
+    topics = ", ".join(_set_topics(count, ctx.constraints))
+    passage_prompt = PROMPT_PASSAGE_BASE.format(
+        passage_type=passage_type, context=random.choice(CONTEXTS), count=count, topics=topics, difficulty=difficulty
+    )
+    passage: Passage | None = None
+    ledger = ledger_for(ctx)
+    for (t, p) in [(0.8, 0.95), (0.9, 0.95)]:
+        if not ledger.can_afford():
+            break
+        resp = await call_gemini_json_async(passage_prompt, system=SYSTEM_PASSAGE, temperature=t, top_p=p,
+                                            max_output_tokens=1024, stage="passage", ledger=ledger)
+        passage = _coerce_passage(resp)
+        if passage:
+            break
+    if passage is None:
+        return None, []
+    # Passage goes ahead of the prompt as shared context rather than being repeated per item
+    items_prompt = PROMPT_SET_ITEMS_BASE.format(count=count, topics=topics, difficulty=difficulty)
+    items: list[Item] = []
+    for (t, p) in [(0.6, 0.9), (0.8, 0.95)]:
+        if not ledger.can_afford():
+            break
+        resp = await call_gemini_json_async(items_prompt, system=SYSTEM_SET_ITEMS, context=f"Passage:\n{passage.text}",
+                                            temperature=t, top_p=p, max_output_tokens=512 * count,
+                                            stage=workload_stage("items", count), ledger=ledger)
+        raw_items = (resp.get("items") or []) if isinstance(resp, dict) else []
+        items = await run_cpu(_coerce_items, raw_items, limit=count, size=approx_size(raw_items))
+        if items:
+            break
+    for it in items:
+        it.evidence_ids = [passage.id]
+        it.difficulty = difficulty
+    return passage, items
+
+
 def register(router: Router) -> None:
     # Planner: topic -> skill.plan.english
     async def handle_topic(msg: dict) -> None:
         ctx = JobContext(**msg["ctx"])  # type: ignore[arg-type]
         topic = msg.get("topic", "reading")
-        plan_resp = await call_gemini_json_async(PROMPT_PLAN_TEMPLATE.format(topic=topic), system=SYSTEM_PLAN)
+        plan_resp = await call_gemini_json_async(PROMPT_PLAN_TEMPLATE.format(topic=topic), system=SYSTEM_PLAN,
+                                                 stage="plan", ledger=ledger_for(ctx))
         plan = _parse_plan(plan_resp, topic)
         await router.emit(EVENT_OUT_PLAN, {"ctx": ctx.to_dict(), "skill_plan": plan})
 
@@ -113,6 +207,19 @@ def register(router: Router) -> None:
     async def handle_plan(msg: dict) -> None:
         ctx = JobContext(**msg["ctx"])  # type: ignore[arg-type]
         plan = msg.get("skill_plan") or []
+        set_size = int(ctx.constraints.get("items_per_passage") or 1) if isinstance(ctx.constraints, dict) else 1
+        set_size = min(set_size, MAX_ITEMS_PER_PASSAGE)
+        if set_size > 1:
+            ptype = "informational"
+            if plan and isinstance(plan, list) and isinstance(plan[0], dict):
+                ptype = plan[0].get("passage_type") or ptype
+            passage, set_items = await _generate_passage_set(ctx, set_size, ptype)
+            await router.emit(EVENT_OUT_ITEMS, {
+                "ctx": ctx.to_dict(),
+                "items": [i.to_dict() for i in set_items],
+                "passages": [passage.to_dict()] if passage else [],
+            })
+            return
         plan_hint = ""
         if plan and isinstance(plan, list):
             p0 = plan[0]
@@ -122,12 +229,16 @@ def register(router: Router) -> None:
         # Retry up to 2 times with topic pairing
         retries = [(0.6, 0.9), (0.8, 0.95)]  # (temperature, top_p)
         items: list[Item] = []
-        topic_a, topic_b = random.sample(ENGLISH_TOPICS, 2)
+        topic_a, topic_b = pick_topic_pair(ctx.constraints, ENGLISH_TOPICS)
         difficulty = int(ctx.constraints.get("difficulty", 2)) if isinstance(ctx.constraints, dict) else 2
         context = random.choice(CONTEXTS)
         prompt = PROMPT_ITEMS_BASE.format(topic_a=topic_a, topic_b=topic_b, difficulty=difficulty, context=context) + plan_hint
+        ledger = ledger_for(ctx)
         for (t, p) in retries:
-            resp = await call_gemini_json_async(prompt, system=SYSTEM_ITEMS, temperature=t, top_p=p)
+            if not ledger.can_afford():
+                break
+            resp = await call_gemini_json_async(prompt, system=SYSTEM_ITEMS, temperature=t, top_p=p,
+                                                stage="items", ledger=ledger)
             raw_items = (resp.get("items") or []) if isinstance(resp, dict) else []
             items = _coerce_items(raw_items)
             if items:
@@ -0,0 +1,253 @@
+from __future__ import annotations
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+from shared.gemini import call_gemini_json_async
+
+try:  # Pillow is a dependency; without it images are passed through and only exact repeats hit the cache
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - depends on environment
+    Image = None
+    ImageOps = None
+
+IMAGE_TYPES = {"graph", "diagram", "geometry", "table", "pattern", "other"}
+MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1024"))
+# Near-duplicate reuse is opt-in: a dHash within this many bits (of 64) is a candidate, confirmed
+# only if every pixel of a 64x64 grayscale thumbnail is within IMAGE_CONFIRM_TOLERANCE. 0 = exact only.
+HASH_DISTANCE = int(os.getenv("IMAGE_HASH_DISTANCE", "0"))
+CONFIRM_TOLERANCE = int(os.getenv("IMAGE_CONFIRM_TOLERANCE", "8"))
+THUMB_SIDE = 64
+CACHE_PATH = os.getenv("IMAGE_CACHE_PATH", os.path.join("questions", "image_cache.json"))
+WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(8 * 1024 * 1024)))
+
+# Magic-byte signatures of the formats Gemini accepts inline (used when Pillow is unavailable)
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+SYSTEM_DESCRIBE = (
+    "You describe images for Year 6 exam question writers."
+    " Capture every value, label, axis, shape and measurement needed to write a question from the text alone."
+    " Respond ONLY with JSON: {\"description\": str (max 500 chars), \"type\": graph|diagram|geometry|table|pattern|other}."
+)
+
+PROMPT_DESCRIBE = (
+    "Describe this image precisely and compactly for a question writer who cannot see it."
+    " Include all numbers and labels exactly as shown."
+)
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime_type: str
+    key: str  # exact cache key: "px:<sha256 of normalized pixels>", or "sha256:<hex>" of the bytes without Pillow
+    phash: str = ""  # 16 hex chars (64-bit difference hash); empty without Pillow
+    thumb: bytes = b""  # THUMB_SIDE x THUMB_SIDE grayscale pixels, to confirm near-duplicates
+    width: int = 0
+    height: int = 0
+
+
+Describer = Callable[[PreparedImage], Awaitable[Dict]]
+
+
+def _dhash(img: "Image.Image", size: int = 8) -> str:
+    # Difference hash: compare adjacent pixels of a (size+1)x(size) grayscale thumbnail
+    small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = px[row * (size + 1) + col]
+            right = px[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+    return f"{bits:016x}"
+
+
+def sniff_mime_type(data: bytes) -> Optional[str]:
+    for magic, mime in _SIGNATURES:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def preprocess_image(data: bytes) -> PreparedImage:
+    """Downscale and normalize an uploaded image and compute its cache keys (CPU-bound).
+
+    Raises ValueError for oversized or undecodable uploads.
+    """
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise ValueError(f"image exceeds {MAX_UPLOAD_BYTES} bytes")
+    if Image is None:
+        mime_type = sniff_mime_type(data)
+        if mime_type is None:
+            raise ValueError("unsupported image format")
+        return PreparedImage(data=data, mime_type=mime_type, key="sha256:" + hashlib.sha256(data).hexdigest())
+    try:
+        img = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError("image could not be decoded") from e
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        img = background
+    img.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+    h = hashlib.sha256(f"{img.mode}:{img.width}x{img.height}:".encode("ascii"))
+    h.update(img.tobytes())
+    thumb = img.convert("L").resize((THUMB_SIDE, THUMB_SIDE), Image.LANCZOS).tobytes()
+    out = io.BytesIO()
+    img.save(out, format="PNG", optimize=True)
+    return PreparedImage(data=out.getvalue(), mime_type="image/png", key="px:" + h.hexdigest(), phash=_dhash(img),
+                         thumb=thumb, width=img.width, height=img.height)
+
+
+def _hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def _thumbs_match(a: bytes, b: bytes, tolerance: int) -> bool:
+    return len(a) == len(b) > 0 and all(abs(x - y) <= tolerance for x, y in zip(a, b))
+
+
+class DescriptionCache:
+    """Exact normalized-pixel hash -> description store, persisted as JSON.
+
+    A 64-bit dHash alone cannot tell apart two tables with different numbers, so
+    near-duplicate reuse is off unless ``max_distance`` > 0, and even then a candidate
+    must match pixel-by-pixel on a 64x64 thumbnail within ``tolerance``.
+    """
+
+    def __init__(self, path: Optional[str] = CACHE_PATH, max_distance: int = HASH_DISTANCE,
+                 tolerance: int = CONFIRM_TOLERANCE) -> None:
+        self.path = path
+        self.max_distance = max_distance
+        self.tolerance = tolerance
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._written_seq = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                if isinstance(loaded, dict):
+                    self._entries = loaded
+            except (OSError, json.JSONDecodeError):
+                self._entries = {}
+
+    def lookup(self, image: PreparedImage) -> Optional[Dict]:
+        hit = self._entries.get(image.key)
+        if hit is not None or self.max_distance <= 0 or not image.phash:
+            return hit
+        for key, entry in self._entries.items():
+            other = entry.get("phash")
+            if not (key.startswith("px:") and other and _hamming(image.phash, other) <= self.max_distance):
+                continue
+            if _thumbs_match(image.thumb, base64.b64decode(entry.get("thumb") or ""), self.tolerance):
+                return entry
+        return None
+
+    async def store(self, image: PreparedImage, entry: Dict) -> None:
+        """Remember ``entry`` and persist a snapshot of the cache from a worker thread."""
+        stored = dict(entry)
+        if image.phash:
+            stored["phash"] = image.phash
+            stored["thumb"] = base64.b64encode(image.thumb).decode("ascii")
+        self._entries[image.key] = stored
+        if not self.path:
+            return
+        self._seq += 1
+        await asyncio.to_thread(self._write, self._seq, dict(self._entries))
+
+    def _write(self, seq: int, entries: Dict[str, Dict]) -> None:
+        with self._lock:
+            if seq < self._written_seq:
+                return  # a newer snapshot already landed
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+            self._written_seq = seq
+
+
+async def describe_with_gemini(image: PreparedImage) -> Dict:
+    resp = await call_gemini_json_async(
+        PROMPT_DESCRIBE, system=SYSTEM_DESCRIBE, images=[(image.mime_type, image.data)],
+        temperature=0.2, max_output_tokens=400, stage="describe",
+    )
+    if not isinstance(resp, dict) or resp.get("_error") or not resp.get("description"):
+        err = resp.get("_error") if isinstance(resp, dict) else None
+        return {"_error": err or {"status": 502, "message": "no description in model output"}}
+    img_type = str(resp.get("type") or "other")
+    return {
+        "description": str(resp["description"])[:500],
+        "type": img_type if img_type in IMAGE_TYPES else "other",
+    }
+
+
+async def describe_stub(image: PreparedImage) -> Dict:
+    """Offline describer for tests/local runs; never calls the network."""
+    dims = f"{image.width}x{image.height} " if image.width else ""
+    return {
+        "description": f"Uploaded {dims}image (ref {image.key[-8:]}); no description available.",
+        "type": "other",
+        "stub": True,
+    }
+
+
+_DESCRIBERS: Dict[str, Describer] = {"gemini": describe_with_gemini, "stub": describe_stub}
+_pool: Optional[ProcessPoolExecutor] = None
+_cache: Optional[DescriptionCache] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=WORKERS)
+    return _pool
+
+
+def get_cache() -> DescriptionCache:
+    global _cache
+    if _cache is None:
+        _cache = DescriptionCache()
+    return _cache
+
+
+def get_describer(name: Optional[str] = None) -> Describer:
+    return _DESCRIBERS.get(name or os.getenv("IMAGE_DESCRIBER", "gemini"), describe_with_gemini)
+
+
+async def ingest_image(data: bytes, *, describer: Optional[Describer] = None,
+                       cache: Optional[DescriptionCache] = None) -> Dict:
+    """Preprocess in the process pool, reuse a cached description for the same image, else describe.
+
+    The result has no ``description`` (and carries the describer's ``_error``) if describing failed.
+    """
+    loop = asyncio.get_running_loop()
+    prepared = await loop.run_in_executor(_get_pool(), preprocess_image, data)
+    cache = cache or get_cache()
+    ref = prepared.phash or prepared.key
+    hit = cache.lookup(prepared)
+    if hit:
+        return {"description": hit.get("description"), "type": hit.get("type"), "phash": ref, "cached": True}
+    entry = await (describer or get_describer())(prepared)
+    # Stub output is never persisted so a later real describer isn't shadowed by it
+    if entry.get("description") and not entry.get("stub"):
+        await cache.store(prepared, entry)
+    return {**entry, "phash": ref, "cached": False}
@@ -3,8 +3,8 @@ import uuid
 from orchestrator.router import Router
 from shared.schemas import JobContext, Item, Choice
 from shared.gemini import call_gemini_json_async
-from shared.topics import MATH_TOPICS
-import random
+from shared.budget import ledger_for
+from shared.topics import MATH_TOPICS, pick_topic_pair
 
 # Events
 EVENT_IN_TOPIC = "topic.received"
@@ -99,7 +99,8 @@ def register(router: Router) -> None:
     async def handle_topic(msg: dict) -> None:
         ctx = JobContext(**msg["ctx"])  # type: ignore[arg-type]
         topic = msg.get("topic", "mathematical reasoning")
-        plan_resp = await call_gemini_json_async(PROMPT_PLAN_TEMPLATE.format(topic=topic), system=SYSTEM_PLAN)
+        plan_resp = await call_gemini_json_async(PROMPT_PLAN_TEMPLATE.format(topic=topic), system=SYSTEM_PLAN,
+                                                 stage="plan", ledger=ledger_for(ctx))
         plan = _parse_plan(plan_resp, topic)
         await router.emit(EVENT_OUT_PLAN, {"ctx": ctx.to_dict(), "skill_plan": plan})
 
@@ -121,8 +122,9 @@ def register(router: Router) -> None:
         temps = [0.5, 0.8]
         backoff = 1.0
         items: list[Item] = []
+        ledger = ledger_for(ctx)
         # choose two topics
-        topic_a, topic_b = random.sample(MATH_TOPICS, 2)
+        topic_a, topic_b = pick_topic_pair(ctx.constraints, MATH_TOPICS)
         difficulty = int(ctx.constraints.get("difficulty", 2)) if isinstance(ctx.constraints, dict) else 2
         image = ctx.constraints.get("image") if isinstance(ctx.constraints, dict) else None
         prompt = PROMPT_ITEMS_BASE.format(topic_a=topic_a, topic_b=topic_b, difficulty=difficulty) + plan_hint
@@ -134,13 +136,17 @@ def register(router: Router) -> None:
                 "Use the image to construct the problem. Reference 'the image' in the prompt.\n"
             ) + prompt
         for t in temps:
-            resp = await call_gemini_json_async(prompt, system=SYSTEM_ITEMS, temperature=t)
+            if not ledger.can_afford():
+                break
+            resp = await call_gemini_json_async(prompt, system=SYSTEM_ITEMS, temperature=t, stage="items",
+                                                ledger=ledger)
             err = resp.get("_error") if isinstance(resp, dict) else None
-            if err and err.get("status") == 429:
+            if err and err.get("status") == 429 and ledger.can_afford():
                 await _asyncio.sleep(backoff)
                 backoff *= 2
                 # retry same temperature once after backoff
-                resp = await call_gemini_json_async(prompt, system=SYSTEM_ITEMS, temperature=t)
+                resp = await call_gemini_json_async(prompt, system=SYSTEM_ITEMS, temperature=t, stage="items",
+                                                    ledger=ledger)
                 err = resp.get("_error") if isinstance(resp, dict) else None
             raw_items = (resp.get("items") or []) if isinstance(resp, dict) else []
             items = _coerce_items(raw_items)
@@ -4,8 +4,8 @@ import asyncio
 from orchestrator.router import Router
 from shared.schemas import JobContext, Item, Choice
 from shared.gemini import call_gemini_json_async
-from shared.topics import THINKING_TOPICS
-import random
+from shared.budget import ledger_for
+from shared.topics import THINKING_TOPICS, pick_topic_pair
 
 EVENT_IN = "topic.received"
 EVENT_OUT_PLAN = "skill.plan"
@@ -73,14 +73,16 @@ def register(router: Router) -> None:
     async def handle(msg: dict) -> None:
         ctx = JobContext(**msg["ctx"])  # type: ignore[arg-type]
         topic = msg.get("topic", "general reasoning")
+        ledger = ledger_for(ctx)
         # Run plan and items in parallel
         plan_task = asyncio.create_task(
-            call_gemini_json_async(PROMPT_PLAN.format(topic=topic), system=SYSTEM_PLAN)
+            call_gemini_json_async(PROMPT_PLAN.format(topic=topic), system=SYSTEM_PLAN, stage="plan",
+                                   ledger=ledger)
         )
         # Retry items up to 2 times
         async def _gen_items() -> list[Item]:
             temps = [0.5, 0.8]
-            topic_a, topic_b = random.sample(THINKING_TOPICS, 2)
+            topic_a, topic_b = pick_topic_pair(ctx.constraints, THINKING_TOPICS)
             difficulty = int(ctx.constraints.get("difficulty", 2)) if isinstance(ctx.constraints, dict) else 2
             prompt = PROMPT_ITEMS.format(topic_a=topic_a, topic_b=topic_b, difficulty=difficulty)
             image = ctx.constraints.get("image") if isinstance(ctx.constraints, dict) else None
@@ -92,7 +94,10 @@ def register(router: Router) -> None:
                     "Use the image to construct the reasoning task. Reference 'the image' in the prompt.\n"
                 ) + prompt
             for t in temps:
-                resp = await call_gemini_json_async(prompt, system=SYSTEM_ITEMS, temperature=t)
+                if not ledger.can_afford():
+                    break
+                resp = await call_gemini_json_async(prompt, system=SYSTEM_ITEMS, temperature=t,
+                                                    stage="items", ledger=ledger)
                 raw = (resp.get("items") or []) if isinstance(resp, dict) else []
                 items = _coerce_items(raw)
                 if items:
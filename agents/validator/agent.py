@@ -1,8 +1,14 @@
 from __future__ import annotations
-from typing import List, Dict, Tuple
+import copy
+import json
+from typing import List, Dict, Optional, Set, Tuple
 from orchestrator.router import Router
 from shared.schemas import JobContext
 from shared.gemini import call_gemini_json_async
+from shared.budget import BudgetLedger, ledger_for
+from shared.executor import approx_size, run_cpu
+from shared.resilience import workload_stage
+from agents.validator.rules import LABELS, IMAGE_WORDS, duplicate_choice_labels, normalize_answer, repair_locally
 
 IN_TYPES = ["items.math", "items.english", "items.thinking"]
 OUT = "items.validated"
@@ -22,8 +28,28 @@ PROMPT_TEMPLATE = (
     "Items JSON:\n{items_json}"
 )
 
+# Appended when items reference shared passages (sent once above, as context)
+PROMPT_PASSAGES_NOTE = (
+    "\nItems with evidence_ids refer to the passages given above; each must be answerable from"
+    " the referenced passage alone and must not hinge on outside knowledge."
+)
+
+
+SYSTEM_REPAIR = (
+    "You repair Year 6 selective exam MCQs that failed validation."
+    " Make the smallest edit that fixes every listed reason; keep the topic, style, difficulty and item id."
+    " Keep exactly 5 distinct options labelled A–E with a single correct answer, and make the solution match it."
+    " Respond ONLY with JSON: {\"items\": [ {id, prompt, choices:[{id,text}], answer, solution} ] }."
+)
+
+PROMPT_REPAIR_TEMPLATE = (
+    "Fix each item so it passes validation. Reasons are listed per item.\n"
+    "Items JSON:\n{items_json}"
+)
+
 
-def _structural_checks(items: List[Dict], ctx: JobContext) -> Tuple[List[Dict], List[Dict]]:
+def _structural_checks(items: List[Dict], ctx: JobContext,
+                       passage_ids: Optional[Set[str]] = None) -> Tuple[List[Dict], List[Dict]]:
     passes: List[Dict] = []
     fails: List[Dict] = []
     image = ctx.constraints.get("image") if isinstance(ctx.constraints, dict) else None
@@ -36,9 +62,11 @@ def _structural_checks(items: List[Dict], ctx: JobContext) -> Tuple[List[Dict],
         if len(choices) != 5:
             reasons.append("must have exactly 5 choices")
         labels = [c.get("id") for c in choices if isinstance(c, dict)]
-        if labels != ["A", "B", "C", "D", "E"]:
+        if labels != LABELS:
             reasons.append("choice labels must be A,B,C,D,E in order")
-        if answer not in {"A", "B", "C", "D", "E"}:
+        if duplicate_choice_labels(choices):
+            reasons.append("choices must be distinct")
+        if answer not in set(LABELS):
             reasons.append("answer must be one of A–E")
         if not prompt:
             reasons.append("prompt must be non-empty")
@@ -46,9 +74,13 @@ def _structural_checks(items: List[Dict], ctx: JobContext) -> Tuple[List[Dict],
             if not (isinstance(c, dict) and str(c.get("text", "")).strip()):
                 reasons.append("all choices must have non-empty text")
                 break
+        if passage_ids is not None:
+            ev = it.get("evidence_ids") or []
+            if not ev or any(e not in passage_ids for e in ev):
+                reasons.append("evidence_ids must reference a passage in this set")
         # Image reference required when image is provided
         if isinstance(image, dict) and image.get("description"):
-            if "image" not in prompt.lower() and "graph" not in prompt.lower() and "diagram" not in prompt.lower():
+            if not any(w in prompt.lower() for w in IMAGE_WORDS):
                 reasons.append("prompt must reference the image when image_description is provided")
             it["uses_image"] = True
             it["image_description"] = str(image.get("description"))[:500]
@@ -60,24 +92,69 @@ def _structural_checks(items: List[Dict], ctx: JobContext) -> Tuple[List[Dict],
     return passes, fails
 
 
-async def _validate_with_gemini(items: List[Dict]) -> List[Dict]:
+def _compact_item(it: Dict) -> Dict:
+    """Minimal validator view of an item: choices as {label: text}, empty fields dropped."""
+    choices = {
+        str(c.get("id")): c.get("text")
+        for c in (it.get("choices") or [])
+        if isinstance(c, dict)
+    }
+    out = {
+        "id": it.get("id"),
+        "subject": it.get("subject"),
+        "prompt": it.get("prompt"),
+        "choices": choices,
+        "answer": it.get("answer"),
+        "solution": it.get("solution"),
+        "image_description": it.get("image_description"),
+        "evidence_ids": it.get("evidence_ids"),
+    }
+    return {k: v for k, v in out.items() if v not in (None, "", {}, [])}
+
+
+def _passages_context(passages: List[Dict]) -> Optional[str]:
+    blocks = [f"Passage {p.get('id')}:\n{p.get('text')}" for p in passages if isinstance(p, dict) and p.get("text")]
+    return "\n\n".join(blocks) if blocks else None
+
+
+def _items_json(items: List[Dict], reasons: Optional[List[List[str]]] = None) -> str:
+    """Compact JSON for the validator/repair prompt (optionally with per-item failure reasons)."""
+    payload = [_compact_item(it) for it in items]
+    if reasons is not None:
+        payload = [{**p, "reasons": r} for p, r in zip(payload, reasons)]
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def _status(err: object) -> int:
+    return int(err.get("status") or 0) if isinstance(err, dict) else 0
+
+
+def _unvalidated(items: List[Dict], reason: str) -> List[Dict]:
+    # Failed without a verdict: never passed, and not sent to repair (nothing is known to be wrong)
+    return [{"item_id": it.get("id"), "status": "fail", "reasons": [reason], "subject": it.get("subject"),
+             "unvalidated": True} for it in items]
+
+
+async def _validate_with_gemini(items: List[Dict], passages: Optional[List[Dict]] = None,
+                               ledger: Optional[BudgetLedger] = None) -> List[Dict]:
     if not items:
         return []
-    import json as _json
-    items_payload = [
-        {
-            "id": it.get("id"),
-            "subject": it.get("subject"),
-            "prompt": it.get("prompt"),
-            "choices": it.get("choices"),
-            "answer": it.get("answer"),
-            "solution": it.get("solution"),
-            "image_description": it.get("image_description"),
-        }
-        for it in items
-    ]
-    prompt = PROMPT_TEMPLATE.format(items_json=_json.dumps(items_payload, ensure_ascii=False, indent=2))
-    resp = await call_gemini_json_async(prompt, system=SYSTEM, max_output_tokens=800)
+    if ledger is not None and not ledger.can_afford():
+        # Never pass unvalidated items just because the budget ran out
+        return _unvalidated(items, "job budget exhausted before validation")
+    items_json = await run_cpu(_items_json, items, size=approx_size(items))
+    prompt = PROMPT_TEMPLATE.format(items_json=items_json)
+    context = _passages_context(passages or [])
+    if context:
+        prompt += PROMPT_PASSAGES_NOTE
+    resp = await call_gemini_json_async(prompt, system=SYSTEM, context=context,
+                                        max_output_tokens=max(800, 300 * len(items)),
+                                        stage=workload_stage("validate", len(items)), ledger=ledger)
+    err = resp.get("_error") if isinstance(resp, dict) else None
+    if err:
+        # Timeouts, open breaker, quota or bad output: the items were not checked, so they don't pass
+        detail = "circuit open" if isinstance(err, dict) and err.get("circuit_open") else f"status {_status(err)}"
+        return _unvalidated(items, f"validator unavailable ({detail})")
     reports = []
     if isinstance(resp, dict) and isinstance(resp.get("reports"), list):
         reports = resp["reports"]
@@ -91,7 +168,10 @@ async def _validate_with_gemini(items: List[Dict]) -> List[Dict]:
         corrected = r.get("corrected_answer") if isinstance(r, dict) else None
         subject = next((it.get("subject") for it in items if it.get("id") == item_id), None)
         if status not in {"pass", "fail"}:
-            status = "pass"
+            # No usable verdict (missing or unknown status): fail closed, like a missing report
+            norm.append({"item_id": item_id, "status": "fail", "subject": subject, "unvalidated": True,
+                         "reasons": [f"validator report has no usable status ({status!r})"]})
+            continue
         norm.append({
             "item_id": item_id,
             "status": status,
@@ -99,9 +179,8 @@ async def _validate_with_gemini(items: List[Dict]) -> List[Dict]:
             "corrected_answer": corrected,
             "subject": subject,
         })
-    if not norm:
-        norm = [{"item_id": it.get("id"), "status": "pass", "reasons": [], "subject": it.get("subject")} for it in items]
-    return norm
+    reported = {r["item_id"] for r in norm}
+    return norm + _unvalidated([it for it in items if it.get("id") not in reported], "no validator report")
 
 
 def _filter_items_by_reports(items: List[Dict], reports: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
@@ -117,15 +196,120 @@ def _filter_items_by_reports(items: List[Dict], reports: List[Dict]) -> Tuple[Li
     return passed, failed
 
 
+def _coerce_repaired(original: Dict, fixed: Dict) -> Dict:
+    it = copy.deepcopy(original)
+    if fixed.get("prompt"):
+        it["prompt"] = str(fixed["prompt"])
+    raw_choices = fixed.get("choices")
+    if isinstance(raw_choices, dict):
+        raw_choices = [{"id": k, "text": v} for k, v in raw_choices.items()]
+    if isinstance(raw_choices, list) and raw_choices:
+        it["choices"] = [
+            {"id": str(c.get("id") or LABELS[i]), "text": str(c.get("text") or "")} if isinstance(c, dict)
+            else {"id": LABELS[i], "text": str(c)}
+            for i, c in enumerate(raw_choices[:5])
+        ]
+    if fixed.get("answer"):
+        it["answer"] = normalize_answer(fixed["answer"], it["choices"]) or str(fixed["answer"])
+    if fixed.get("solution"):
+        it["solution"] = str(fixed["solution"])
+    return it
+
+
+async def _repair_with_gemini(targets: List[Tuple[Dict, List[str]]], passages: Optional[List[Dict]] = None,
+                              ledger: Optional[BudgetLedger] = None) -> List[Dict]:
+    """One targeted repair call for all failing items; returns repaired copies (same ids)."""
+    # Repair only pays off if the re-validation call fits in the budget too
+    if not targets or (ledger is not None and not ledger.can_afford(calls=2)):
+        return []
+    items_json = await run_cpu(_items_json, [it for it, _ in targets], [r for _, r in targets],
+                               size=approx_size(targets))
+    resp = await call_gemini_json_async(
+        PROMPT_REPAIR_TEMPLATE.format(items_json=items_json), system=SYSTEM_REPAIR,
+        context=_passages_context(passages or []), temperature=0.2,
+        max_output_tokens=max(800, 400 * len(targets)), stage=workload_stage("repair", len(targets)),
+        ledger=ledger,
+    )
+    raw = resp.get("items") if isinstance(resp, dict) else None
+    if not isinstance(raw, list):
+        return []
+    by_id = {it.get("id"): it for it, _ in targets}
+    repaired: List[Dict] = []
+    for fixed in raw:
+        if isinstance(fixed, dict) and fixed.get("id") in by_id:
+            repaired.append(_coerce_repaired(by_id.pop(fixed["id"]), fixed))
+    return repaired
+
+
+async def _check(items: List[Dict], ctx: JobContext, passages: List[Dict],
+                 passage_ids: Optional[Set[str]]) -> Tuple[List[Dict], List[Dict]]:
+    structurally_ok, structural_fails = await run_cpu(_structural_checks, items, ctx, passage_ids,
+                                                      size=approx_size(items))
+    # One call per set: the passage goes out once, not once per item
+    gemini_reports = await _validate_with_gemini(structurally_ok, passages, ledger_for(ctx))
+    passed, failed_gemini = _filter_items_by_reports(structurally_ok, gemini_reports)
+    return passed, structural_fails + failed_gemini
+
+
+async def _repair_failed(items: List[Dict], failed: List[Dict], ctx: JobContext, passages: List[Dict],
+                         passage_ids: Optional[Set[str]]) -> Tuple[List[Dict], List[Dict], List[str]]:
+    """Repair failed items (validator-corrected answer or a targeted repair prompt) and re-validate them.
+
+    Repaired items pass only on a clean re-validation verdict; if that call errors they stay failed.
+    Items that cannot be repaired are dropped here rather than regenerated: a job emits a single
+    items.validated, so callers top up shortfalls with new jobs (the bulk CLI re-queues its rows).
+    """
+    id_to_item = {it.get("id"): it for it in items}
+    repaired: List[Dict] = []
+    to_model: List[Tuple[Dict, List[str]]] = []
+    for rep in failed:
+        it = id_to_item.get(rep.get("item_id"))
+        if it is None or rep.get("unvalidated"):
+            continue
+        reasons = [str(r) for r in (rep.get("reasons") or [])]
+        corrected = normalize_answer(rep.get("corrected_answer"), it.get("choices") or [])
+        if corrected and corrected != it.get("answer"):
+            fixed = copy.deepcopy(it)
+            fixed["answer"] = corrected
+            repaired.append(fixed)
+        else:
+            to_model.append((it, reasons or ["validator rejected the item"]))
+    repaired += await _repair_with_gemini(to_model, passages, ledger_for(ctx))
+    if not repaired:
+        return [], failed, []
+    repaired_ids = {it.get("id") for it in repaired}
+    # Fails closed: an errored or missing re-validation verdict keeps the repaired item failed
+    r_passed, r_failed = await _check(repaired, ctx, passages, passage_ids)
+    still_failed = [f for f in failed if f.get("item_id") not in repaired_ids] + r_failed
+    return r_passed, still_failed, [it.get("id") for it in r_passed]
+
+
 def register(router: Router) -> None:
     async def validate(msg: dict) -> None:
         ctx = JobContext(**msg["ctx"])  # type: ignore[arg-type]
-        items: List[Dict] = msg["items"]
-        structurally_ok, structural_fails = _structural_checks(items, ctx)
-        gemini_reports = await _validate_with_gemini(structurally_ok)
-        passed, failed_gemini = _filter_items_by_reports(structurally_ok, gemini_reports)
-        all_failed = structural_fails + failed_gemini
-        payload: Dict = {"ctx": ctx.to_dict(), "items": passed, "status": "pass", "failed": all_failed}
+        passages: List[Dict] = msg.get("passages") or []
+        passage_ids = {p.get("id") for p in passages if isinstance(p, dict)} if passages else None
+        image = ctx.constraints.get("image") if isinstance(ctx.constraints, dict) else None
+        image_present = isinstance(image, dict) and bool(image.get("description"))
+        # Deterministic fixes first (labels, answer format, image reference): free, no call
+        items: List[Dict] = [repair_locally(it, image_present)[0] for it in msg["items"]]
+        passed, all_failed = await _check(items, ctx, passages, passage_ids)
+        repaired_ids: List[str] = []
+        if all_failed:
+            # One repair round (single call) instead of a full plan+generate round trip
+            r_passed, all_failed, repaired_ids = await _repair_failed(items, all_failed, ctx, passages, passage_ids)
+            passed += r_passed
+        ledger = ledger_for(ctx)
+        payload: Dict = {"ctx": ctx.to_dict(), "items": passed, "status": "pass", "failed": all_failed,
+                         "cost": ledger.report()}
+        if ledger.exhausted():
+            payload["status"] = "partial"
+            payload["budget_exhausted"] = True
+        if repaired_ids:
+            payload["repaired"] = repaired_ids
+        if passages:
+            used = {e for it in passed for e in (it.get("evidence_ids") or [])}
+            payload["passages"] = [p for p in passages if p.get("id") in used]
         await router.emit(OUT, payload)
 
     for ev in IN_TYPES:
@@ -0,0 +1,73 @@
+from __future__ import annotations
+import copy
+import re
+from typing import Dict, List, Optional, Tuple
+
+LABELS = ["A", "B", "C", "D", "E"]
+IMAGE_WORDS = ("image", "graph", "diagram")
+
+
+def _norm_text(text: object) -> str:
+    return re.sub(r"\s+", " ", str(text or "")).strip().lower()
+
+
+def normalize_answer(answer: object, choices: List[Dict]) -> Optional[str]:
+    """Map answers like 'c', '(C)', 'C) 12' or the correct option's text to a label A–E."""
+    raw = str(answer or "").strip()
+    target = _norm_text(raw)
+    if target:
+        # Exact option text first, so an answer like "A quarter" isn't read as label A
+        for c in choices:
+            if isinstance(c, dict) and _norm_text(c.get("text")) == target:
+                return str(c.get("id"))
+    m = re.fullmatch(r"[\(\[]?\s*([A-Ea-e])\s*(?:[\)\]\.:]\s*.*)?", raw)
+    if m:
+        return m.group(1).upper()
+    return None
+
+
+def duplicate_choice_labels(choices: List[Dict]) -> List[str]:
+    seen: Dict[str, str] = {}
+    dups: List[str] = []
+    for c in choices:
+        if not isinstance(c, dict):
+            continue
+        key = _norm_text(c.get("text"))
+        if key and key in seen:
+            dups.append(str(c.get("id")))
+        else:
+            seen[key] = str(c.get("id"))
+    return dups
+
+
+def repair_locally(item: Dict, image_present: bool) -> Tuple[Dict, List[str]]:
+    """Apply deterministic fixes; return (repaired copy, list of fixes applied)."""
+    it = copy.deepcopy(item)
+    fixes: List[str] = []
+    choices = [c for c in (it.get("choices") or []) if isinstance(c, dict)]
+    # Relabel choices A–E in order, carrying the answer across if it pointed at an old label
+    old_labels = [str(c.get("id")) for c in choices]
+    if old_labels != LABELS[: len(choices)]:
+        old_answer = str(it.get("answer") or "").strip()
+        answer_text = next((c.get("text") for c in choices if str(c.get("id")) == old_answer), None)
+        for c, label in zip(choices, LABELS):
+            c["id"] = label
+        if answer_text is not None:
+            it["answer"] = next(str(c["id"]) for c in choices if c.get("text") == answer_text)
+        fixes.append("relabelled choices")
+    it["choices"] = choices
+    answer = str(it.get("answer") or "").strip()
+    if answer not in LABELS:
+        label = normalize_answer(answer, choices)
+        if label:
+            it["answer"] = label
+            fixes.append("normalized answer")
+    for c in choices:
+        stripped = str(c.get("text") or "").strip()
+        if stripped != c.get("text"):
+            c["text"] = stripped
+    prompt = str(it.get("prompt") or "").strip()
+    if image_present and prompt and not any(w in prompt.lower() for w in IMAGE_WORDS):
+        it["prompt"] = f"Use the image to answer. {prompt}"
+        fixes.append("added image reference")
+    return it, fixes
@@ -1,19 +1,53 @@
 from __future__ import annotations
 import asyncio
-from typing import Literal, Optional, Dict, List
-from fastapi import FastAPI
-from pydantic import BaseModel, Field
-from orchestrator.router import Router
-from orchestrator.jobs import start_job
+import base64
+import binascii
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Deque, Literal, Optional, Dict, List, Tuple
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+from orchestrator.jobs import run_job
 from agents.thinking.agent import register as reg_thinking
 from agents.math.agent import register as reg_math
 from agents.english.agent import register as reg_english
 from agents.validator.agent import register as reg_validator
+from agents.image_to_text.agent import MAX_UPLOAD_BYTES, ingest_image
 import contextlib
-import random
-from shared.topics import MATH_TOPICS, THINKING_TOPICS, ENGLISH_TOPICS
+import math
+import os
+from orchestrator.scheduler import CoverageScheduler, verdicts
+from shared.gemini import default_model
+from shared.executor import loop_lag, run_cpu
+from shared.resilience import breaker_for, breaker_status, latency, pipeline_deadline, workload_stage
+from shared.storage import load_inventory
 
-app = FastAPI(title="Question-Gen API", version="0.1.0")
+
+@contextlib.asynccontextmanager
+async def _lifespan(_: FastAPI) -> AsyncIterator[None]:
+    loop_lag.start()
+    try:
+        yield
+    finally:
+        loop_lag.stop()
+
+
+app = FastAPI(title="Question-Gen API", version="0.1.0", lifespan=_lifespan)
+
+SUBJECT_REGISTRARS = {"thinking": reg_thinking, "math": reg_math, "english": reg_english}
+# Base64 length of the largest accepted upload, plus room for a data: URL prefix
+MAX_IMAGE_BASE64_CHARS = 4 * -(-MAX_UPLOAD_BYTES // 3) + 128
+
+
+class JobBudget(BaseModel):
+    # Unknown keys are rejected; values can only tighten DEFAULT_BUDGET (see _job_budget)
+    model_config = ConfigDict(extra="forbid")
+    max_calls: Optional[float] = Field(default=None, ge=0)
+    max_input_tokens: Optional[float] = Field(default=None, ge=0)
+    max_output_tokens: Optional[float] = Field(default=None, ge=0)
+    max_wall_s: Optional[float] = Field(default=None, ge=0)
 
 
 class GenerateRequest(BaseModel):
@@ -21,65 +55,342 @@ class GenerateRequest(BaseModel):
     difficulty: Optional[int] = 2  # 1..3
     image_description: Optional[str] = Field(default=None, max_length=500)
     image_type: Optional[Literal["graph", "diagram", "geometry", "table", "pattern", "other"]] = None
+    items_per_passage: Optional[int] = Field(default=None, ge=1, le=6)  # english only
+    image_base64: Optional[str] = Field(default=None, max_length=MAX_IMAGE_BASE64_CHARS)  # math/thinking; described (and cached) when image_description is absent
+    budget: Optional[JobBudget] = None
+    priority: Literal["interactive", "bulk"] = "interactive"
+
+
+class DescribeImageRequest(BaseModel):
+    image_base64: str = Field(max_length=MAX_IMAGE_BASE64_CHARS)
+
+
+class DescribeImageResponse(BaseModel):
+    description: Optional[str] = None
+    type: Optional[str] = None
+    phash: str
+    cached: bool
 
 
 class GenerateResponse(BaseModel):
     items: List[dict]
     failed: List[dict]
+    passages: List[dict] = Field(default_factory=list)
+    source: Literal["generated", "inventory"] = "generated"
+    cost: Optional[dict] = None
+
+
+GENERATE_TIMEOUT_S = float(os.getenv("GENERATE_TIMEOUT_S", "30"))
+# Per-request default; plan + items retries + validate + repair + re-validate fit comfortably
+DEFAULT_BUDGET: Dict[str, float] = {"max_calls": float(os.getenv("JOB_MAX_CALLS", "12"))}
+
+
+def _job_budget(requested: Optional[JobBudget]) -> Dict[str, float]:
+    """Server defaults, each lowered (never raised) by the client's value."""
+    budget = dict(DEFAULT_BUDGET)
+    for key, value in (requested.model_dump(exclude_none=True) if requested else {}).items():
+        budget[key] = min(value, budget[key]) if key in budget else value
+    return budget
+# Sequential Gemini stages per subject (thinking plans in parallel with items)
+_PIPELINE_STAGES = {
+    "thinking": ("items", "validate", "repair", "validate"),
+    "math": ("plan", "items", "validate", "repair", "validate"),
+    "english": ("plan", "items", "validate", "repair", "validate"),
+}
+
+
+def _pipeline_stages(req: GenerateRequest) -> Tuple[str, ...]:
+    """Latency stages a request will run through, keyed like the agents' calls."""
+    stages = _PIPELINE_STAGES[req.subject]
+    count = int(req.items_per_passage or 1) if req.subject == "english" else 1
+    if count > 1:
+        stages = ("plan", "passage", workload_stage("items", count), workload_stage("validate", count),
+                  workload_stage("repair", count), workload_stage("validate", count))
+    if req.subject in ("math", "thinking") and req.image_base64 and not req.image_description:
+        stages = ("describe",) + stages
+    return stages
+
+PRIORITIES = ("interactive", "bulk")
+
+
+@dataclass
+class AdmissionTicket:
+    granted_at: float = 0.0
+    sample: bool = True  # False for fast paths (inventory/503) that must not skew the service-time average
+
+
+class AdmissionController:
+    """Bounded, priority-ordered admission for /generate.
+
+    Interactive requests are dispatched before bulk ones and ``bulk_reserve`` slots are kept
+    free for them; within a class, clients are served round-robin. Requests are rejected
+    up front (429 when queues are full, 503 when the estimated wait plus service time exceeds
+    their deadline).
+    """
+
+    def __init__(self, concurrency: int = 8, max_queue: int = 64, per_client: int = 16,
+                 bulk_reserve: int = 2, initial_service_s: float = 10.0) -> None:
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.per_client = per_client
+        self.bulk_reserve = min(bulk_reserve, self.concurrency - 1)
+        self.avg_service_s = initial_service_s
+        self.active = 0
+        self.active_bulk = 0
+        self._waiting: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {p: OrderedDict() for p in PRIORITIES}
+
+    def _queued(self, priority: Optional[str] = None, client: Optional[str] = None) -> int:
+        classes = [priority] if priority else list(PRIORITIES)
+        total = 0
+        for p in classes:
+            for c, q in self._waiting[p].items():
+                if client is None or c == client:
+                    total += len(q)
+        return total
+
+    def _can_start(self, priority: str) -> bool:
+        if self.active >= self.concurrency:
+            return False
+        return priority == "interactive" or self.active < self.concurrency - self.bulk_reserve
+
+    def estimate_wait(self, priority: str) -> float:
+        ahead = self._queued("interactive") + (self._queued("bulk") if priority == "bulk" else 0)
+        if not ahead and self._can_start(priority):
+            return 0.0
+        slots = self.concurrency if priority == "interactive" else max(1, self.concurrency - self.bulk_reserve)
+        return math.ceil((ahead + 1) / slots) * self.avg_service_s
+
+    def _reject(self, status: int, detail: str, retry_after: float) -> HTTPException:
+        return HTTPException(status_code=status, detail=detail,
+                             headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+    def _grant(self, priority: str) -> None:
+        self.active += 1
+        if priority == "bulk":
+            self.active_bulk += 1
+
+    def _release(self, priority: str) -> None:
+        self.active -= 1
+        if priority == "bulk":
+            self.active_bulk -= 1
+        self._dispatch()
 
+    def _dispatch(self) -> None:
+        for priority in PRIORITIES:
+            clients = self._waiting[priority]
+            while clients and self._can_start(priority):
+                client, q = next(iter(clients.items()))
+                fut = q.popleft()
+                if q:
+                    clients.move_to_end(client)  # round-robin across clients
+                else:
+                    del clients[client]
+                if fut.done():
+                    continue
+                self._grant(priority)
+                fut.set_result(None)
 
-def _pick_seed_topic_for_subject(subject: str) -> str:
-    pool: List[str]
-    if subject == "math":
-        pool = MATH_TOPICS
-    elif subject == "thinking":
-        pool = THINKING_TOPICS
-    else:
-        pool = ENGLISH_TOPICS
-    sample = random.sample(pool, k=min(2, len(pool)))
-    return " and ".join(sample)
+    def _remove(self, priority: str, client: str, fut: asyncio.Future) -> None:
+        q = self._waiting[priority].get(client)
+        if q is not None and fut in q:
+            q.remove(fut)
+            if not q:
+                del self._waiting[priority][client]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, client: str, priority: str, deadline_s: float) -> AsyncIterator[AdmissionTicket]:
+        """Hold a slot; ``deadline_s`` covers queue wait plus service, measured from the call."""
+        ticket = AdmissionTicket()
+        if self.estimate_wait(priority) == 0.0:
+            self._grant(priority)
+        else:
+            if self._queued() >= self.max_queue:
+                raise self._reject(429, "server busy: request queue full", self.avg_service_s)
+            if self._queued(client=client) >= self.per_client:
+                raise self._reject(429, "too many queued requests for this client", self.avg_service_s)
+            wait = self.estimate_wait(priority)
+            if wait + self.avg_service_s > deadline_s:
+                raise self._reject(503, "estimated queue wait exceeds deadline", wait)
+            fut: asyncio.Future = asyncio.get_running_loop().create_future()
+            self._waiting[priority].setdefault(client, deque()).append(fut)
+            try:
+                # Leave room for the typical service time inside the deadline
+                await asyncio.wait_for(asyncio.shield(fut), timeout=max(0.0, deadline_s - self.avg_service_s))
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if fut.done() and not fut.cancelled():
+                    self._release(priority)  # granted just as we gave up
+                else:
+                    fut.cancel()
+                    self._remove(priority, client, fut)
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self._reject(503, "queue wait exceeded deadline", self.avg_service_s)
+                raise
+        ticket.granted_at = time.monotonic()
+        try:
+            yield ticket
+        finally:
+            if ticket.sample:
+                # EWMA of service time drives the wait estimate
+                self.avg_service_s = 0.8 * self.avg_service_s + 0.2 * (time.monotonic() - ticket.granted_at)
+            self._release(priority)
+
+    def status(self) -> Dict:
+        return {
+            "active": self.active,
+            "active_bulk": self.active_bulk,
+            "queued": {p: self._queued(p) for p in PRIORITIES},
+            "avg_service_s": round(self.avg_service_s, 2),
+        }
+
+
+_admission = AdmissionController(
+    concurrency=int(os.getenv("ADMISSION_CONCURRENCY", "8")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+    per_client=int(os.getenv("ADMISSION_PER_CLIENT", "16")),
+    bulk_reserve=int(os.getenv("ADMISSION_BULK_RESERVE", "2")),
+)
+BULK_MAX_WAIT_S = float(os.getenv("ADMISSION_BULK_MAX_WAIT_S", "300"))
+
+_scheduler = CoverageScheduler(
+    quota=int(os.getenv("SCHEDULER_QUOTA", "5")),
+    state_path=os.getenv("SCHEDULER_STATE_PATH") or None,
+)
+
+
+def _pick_seed_topics_for_subject(subject: str, difficulty: int) -> List[str]:
+    return list(_scheduler.next_pair(subject, difficulty))
+
+
+def _decode_image(b64: str) -> bytes:
+    if "," in b64 and b64.lstrip().startswith("data:"):
+        b64 = b64.split(",", 1)[1]
+    try:
+        return base64.b64decode(b64, validate=True)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="image_base64 is not valid base64")
+
+
+async def _describe_image(b64: str) -> Dict:
+    try:
+        result = await ingest_image(await run_cpu(_decode_image, b64, size=len(b64)))
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail="image could not be decoded")
+    if not result.get("description"):
+        # Never fall through to a question without the image the caller asked about
+        breaker = breaker_for(default_model())
+        if breaker.state != "closed":
+            raise HTTPException(status_code=503, detail="image description unavailable: upstream model unavailable",
+                                headers={"Retry-After": str(max(1, math.ceil(breaker.retry_after())))})
+        err = result.get("_error") or {}
+        raise HTTPException(status_code=502, detail=f"image description failed: {err.get('message') or 'no description'}"[:300])
+    return result
+
+
+def _client_id(request: Request) -> str:
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "anonymous")
+
+
+@app.post("/images/describe", response_model=DescribeImageResponse)
+async def describe_image(req: DescribeImageRequest, request: Request) -> DescribeImageResponse:
+    # Describing is a Gemini call: it queues with interactive generation under the same limit
+    async with _admission.slot(_client_id(request), "interactive", GENERATE_TIMEOUT_S) as ticket:
+        ticket.sample = False  # a describe is not a generate; keep it out of the service-time average
+        result = await _describe_image(req.image_base64)
+    return DescribeImageResponse(**result)
+
+
+async def _fallback(req: GenerateRequest, difficulty: int, retry_after: float):
+    """Serve stored inventory while the upstream is unavailable, else fail fast with 503."""
+    count = int(req.items_per_passage or 1) if req.subject == "english" else 1
+    # Scans saved files: keep it off the event loop
+    items, passages = await asyncio.to_thread(load_inventory, req.subject, difficulty, limit=count)
+    if items:
+        return GenerateResponse(items=items, failed=[], passages=passages, source="inventory")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "upstream model unavailable"},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+@app.get("/health/loop")
+async def loop_health() -> Dict:
+    return loop_lag.stats()
+
+
+@app.get("/health/admission")
+async def admission_health() -> Dict:
+    return _admission.status()
+
+
+@app.get("/health/upstream")
+async def upstream_health() -> Dict:
+    return {"breakers": breaker_status(), "latency": latency.snapshot()}
+
+
+@app.get("/coverage/{subject}")
+async def coverage(subject: Literal["thinking", "math", "english"]) -> Dict:
+    return _scheduler.coverage(subject)
 
 
 @app.post("/generate", response_model=GenerateResponse)
-async def generate(req: GenerateRequest) -> GenerateResponse:
-    router = Router()
-    # Register only the requested subject
-    if req.subject == "thinking":
-        reg_thinking(router)
-    elif req.subject == "math":
-        reg_math(router)
-    else:
-        reg_english(router)
-    reg_validator(router)
-
-    items: List[dict] = []
-    failures: List[dict] = []
-    done = asyncio.Event()
-
-    async def sink(msg: dict) -> None:
-        nonlocal items, failures
-        items.extend(msg.get("items", []))
-        failures.extend(msg.get("failed", []))
-        done.set()
-
-    router.subscribe("items.validated", sink)
-
-    # Run router and job
-    loop_task = asyncio.create_task(router.run())
-    seed_topic = _pick_seed_topic_for_subject(req.subject)
-    constraints: Dict = {"difficulty": req.difficulty}
-    if req.subject in ("math", "thinking") and req.image_description:
-        constraints["image"] = {"description": req.image_description, "type": req.image_type}
-    await start_job(router, topic=seed_topic, constraints=constraints)
-
-    # Timeout guard: 30s
+async def generate(req: GenerateRequest, request: Request) -> GenerateResponse:
+    arrived = time.monotonic()
+    client = _client_id(request)
+    # Interactive callers need an answer (queueing included) within the generate deadline;
+    # bulk callers may queue up to BULK_MAX_WAIT_S before their run
+    deadline_s = GENERATE_TIMEOUT_S if req.priority == "interactive" else BULK_MAX_WAIT_S + GENERATE_TIMEOUT_S
+    async with _admission.slot(client, req.priority, deadline_s) as ticket:
+        return await _generate(req, arrived + deadline_s, ticket)
+
+
+async def _generate(req: GenerateRequest, deadline_at: float,
+                    ticket: Optional[AdmissionTicket] = None) -> GenerateResponse:
+    difficulty = int(req.difficulty or 2)
+    model = default_model()
+    breaker = breaker_for(model)
+    if breaker.state == "open":
+        if ticket is not None:
+            ticket.sample = False
+        return await _fallback(req, difficulty, breaker.retry_after())
+    # Whatever the queue left of the deadline, tightened by per-stage latency (image description included)
+    deadline_at = min(deadline_at, time.monotonic() + pipeline_deadline(model, _pipeline_stages(req),
+                                                                        GENERATE_TIMEOUT_S))
+    constraints: Dict = {"difficulty": difficulty}
+    image_description, image_type = req.image_description, req.image_type
+    if req.subject in ("math", "thinking") and req.image_base64 and not image_description:
+        described = await _describe_image(req.image_base64)
+        image_description = described.get("description")
+        image_type = image_type or described.get("type")
+    if req.subject in ("math", "thinking") and image_description:
+        constraints["image"] = {"description": image_description, "type": image_type}
+    if req.subject == "english" and req.items_per_passage:
+        constraints["items_per_passage"] = req.items_per_passage
+
+    topics = _pick_seed_topics_for_subject(req.subject, difficulty)
+    constraints["topics"] = topics
+    pair = (topics[0], topics[1])
     try:
-        await asyncio.wait_for(done.wait(), timeout=30)
-    except asyncio.TimeoutError:
-        pass
+        # Register only the requested subject
+        _, result = await run_job(
+            [SUBJECT_REGISTRARS[req.subject], reg_validator],
+            topic=" and ".join(topics),
+            constraints=constraints,
+            budget=_job_budget(req.budget),
+            timeout_s=max(0.0, deadline_at - time.monotonic()),
+        )
+        timed_out = result is None
+        result = result or {}
+        items: List[dict] = result.get("items", [])
+        failures: List[dict] = result.get("failed", [])
+        passages: List[dict] = result.get("passages", [])
+        cost: Dict = result.get("cost") or {}
+        # Only real validator verdicts count; timeouts and outages say nothing about the pair
+        _scheduler.record(req.subject, pair, difficulty, *verdicts(result))
     finally:
-        loop_task.cancel()
-        with contextlib.suppress(asyncio.CancelledError):
-            await loop_task
-
-    return GenerateResponse(items=items, failed=failures) 
\ No newline at end of file
+        _scheduler.release(req.subject, pair, difficulty)
+    if not items and (timed_out or breaker.state != "closed"):
+        return await _fallback(req, difficulty, breaker.retry_after() or 1.0)
+    return GenerateResponse(items=items, failed=failures, passages=passages, cost=cost or None) 
\ No newline at end of file
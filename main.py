@@ -0,0 +1,333 @@
+"""Question-Gen CLI.
+
+Demo (one item per subject):
+    python main.py
+
+Bulk bank-building from a manifest (CSV or JSONL rows of subject, difficulty, count and
+optional image_description / image_type / image_path / items_per_passage):
+    python main.py --manifest bank.csv --concurrency 4 --journal runs/journal.jsonl
+
+Rows whose saved item count already meets ``count`` are skipped, so re-running the same
+manifest resumes where the previous run stopped.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from agents.english.agent import register as reg_english
+from agents.image_to_text.agent import ingest_image
+from agents.math.agent import register as reg_math
+from agents.thinking.agent import register as reg_thinking
+from agents.validator.agent import register as reg_validator
+from orchestrator.jobs import run_job
+from orchestrator.router import EventJournal
+from orchestrator.scheduler import CoverageScheduler, verdicts
+from shared.executor import loop_lag
+from shared.gemini import default_model
+from shared.resilience import breaker_for
+from shared.storage import count_saved, save_items
+
+SUBJECT_REGISTRARS = {"thinking": reg_thinking, "math": reg_math, "english": reg_english}
+MAX_ATTEMPTS_FACTOR = 4  # give up on a row after this many jobs per item still missing
+# Jobs lost to an outage (timeout, open breaker, spent budget) don't use up attempts; this many
+# of them per allowed attempt still ends the row, so a run can't spin forever
+MAX_OUTAGE_FACTOR = 4
+
+
+@dataclass
+class ManifestRow:
+    subject: str
+    difficulty: int
+    count: int
+    image_description: Optional[str] = None
+    image_type: Optional[str] = None
+    image_path: Optional[str] = None
+    items_per_passage: int = 1
+    key: str = ""
+    done: int = 0
+    inflight: int = 0
+    attempts: int = 0
+    max_attempts: int = 0
+    outages: int = 0
+    error: Optional[str] = None
+
+    @property
+    def per_job(self) -> int:
+        return self.items_per_passage if self.subject == "english" else 1
+
+    def needs_work(self) -> bool:
+        return (self.done + self.inflight * self.per_job < self.count and self.attempts < self.max_attempts
+                and self.outages < self.max_attempts * MAX_OUTAGE_FACTOR)
+
+
+def _outage(result: Optional[Dict]) -> bool:
+    """True if a job ended without a verdict of its own: timed out, ran out of budget, or hit an outage."""
+    if not result or result.get("budget_exhausted"):
+        return True
+    judged, _ = verdicts(result)
+    if judged:
+        return False
+    failed = result.get("failed") or []
+    return (bool(failed) and all(f.get("unvalidated") for f in failed)) or breaker_for(default_model()).state != "closed"
+
+
+def _row_key(row: ManifestRow, seen: Dict[str, int]) -> str:
+    ident = json.dumps([row.image_description, row.image_type, row.image_path, row.items_per_passage])
+    base = f"{row.subject}-d{row.difficulty}-{hashlib.sha1(ident.encode('utf-8')).hexdigest()[:8]}"
+    seen[base] = seen.get(base, 0) + 1
+    return base if seen[base] == 1 else f"{base}-{seen[base]}"
+
+
+def load_manifest(path: str) -> List[ManifestRow]:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            raw = [json.loads(line) for line in f if line.strip()]
+        else:
+            raw = list(csv.DictReader(f))
+    rows: List[ManifestRow] = []
+    seen: Dict[str, int] = {}
+    for i, r in enumerate(raw, start=1):
+        subject = str(r.get("subject") or "").strip()
+        if subject not in SUBJECT_REGISTRARS:
+            raise ValueError(f"manifest row {i}: unknown subject {subject!r}")
+        row = ManifestRow(
+            subject=subject,
+            difficulty=int(r.get("difficulty") or 2),
+            count=int(r.get("count") or 1),
+            image_description=(r.get("image_description") or None),
+            image_type=(r.get("image_type") or None),
+            image_path=(r.get("image_path") or None),
+            items_per_passage=max(1, int(r.get("items_per_passage") or 1)),
+        )
+        row.key = _row_key(row, seen)
+        rows.append(row)
+    return rows
+
+
+class BulkRunner:
+    def __init__(self, rows: List[ManifestRow], concurrency: int = 4, base_dir: str = "questions",
+                 journal: Optional[EventJournal] = None, timeout_s: float = 120.0, max_calls: int = 12,
+                 scheduler: Optional[CoverageScheduler] = None, quiet: bool = False) -> None:
+        self.rows = rows
+        self.concurrency = max(1, concurrency)
+        self.base_dir = base_dir
+        self.journal = journal
+        self.timeout_s = timeout_s
+        self.budget = {"max_calls": max_calls}
+        self.scheduler = scheduler or CoverageScheduler()
+        self.quiet = quiet
+        self._replays: List[Tuple[ManifestRow, List[Tuple[str, dict]]]] = []
+        self._probing = False
+        self.jobs = 0
+        self.calls = 0
+        self.accepted = 0
+        self.target = 0
+        self.started = time.monotonic()
+
+    async def prepare(self) -> None:
+        by_key = {r.key: r for r in self.rows}
+        for row in self.rows:
+            row.done = await asyncio.to_thread(count_saved, row.subject, row.key, self.base_dir)
+            missing = max(0, row.count - row.done)
+            row.max_attempts = -(-missing // row.per_job) * MAX_ATTEMPTS_FACTOR
+            self.target += missing
+            if row.image_path and not row.image_description and missing:
+                try:
+                    described = await ingest_image(await asyncio.to_thread(Path(row.image_path).read_bytes))
+                except (OSError, ValueError) as e:
+                    described = {"_error": {"message": str(e)}}
+                if not described.get("description"):
+                    # Never generate an image row's questions without the image
+                    row.error = "image description failed: " + str((described.get("_error") or {}).get("message"))
+                    row.max_attempts = 0
+                    self.target -= missing
+                    continue
+                row.image_description = described.get("description")
+                row.image_type = row.image_type or described.get("type")
+        if self.journal is not None:
+            # Jobs that keep timing out on replay are given up on, then dropped by the compaction
+            await asyncio.to_thread(self.journal.abandon_stale)
+            await asyncio.to_thread(self.journal.compact)
+            for events in (await asyncio.to_thread(self.journal.pending)).values():
+                ctx = events[0][1].get("ctx") or {}
+                row = by_key.get((ctx.get("constraints") or {}).get("manifest_key"))
+                if row is None:
+                    continue  # another manifest's job
+                if row.needs_work():
+                    row.inflight += 1
+                    self._replays.append((row, events))
+                elif row.done + row.inflight * row.per_job >= row.count:
+                    # Row already full: nothing of this job is left to save
+                    await asyncio.to_thread(self.journal.mark_saved, ctx)
+
+    def _constraints(self, row: ManifestRow, topics: Tuple[str, str]) -> Dict:
+        constraints: Dict = {"difficulty": row.difficulty, "topics": list(topics), "subject": row.subject,
+                             "manifest_key": row.key}
+        if row.subject in ("math", "thinking") and row.image_description:
+            constraints["image"] = {"description": row.image_description, "type": row.image_type}
+        if row.subject == "english" and row.items_per_passage > 1:
+            constraints["items_per_passage"] = row.items_per_passage
+        return constraints
+
+    def _next(self) -> Tuple[Optional[ManifestRow], Optional[List[Tuple[str, dict]]]]:
+        if self._replays:
+            row, events = self._replays.pop(0)
+            return row, events
+        for row in self.rows:
+            if row.needs_work():
+                row.inflight += 1
+                return row, None
+        return None, None
+
+    async def _run_one(self, row: ManifestRow, replay: Optional[List[Tuple[str, dict]]]) -> None:
+        topics: Optional[Tuple[str, str]] = None
+        result: Optional[Dict] = None
+        try:
+            if replay:
+                ctx, result = await run_job([SUBJECT_REGISTRARS[row.subject], reg_validator], journal=self.journal,
+                                            timeout_s=self.timeout_s, replay=replay)
+            else:
+                topics = self.scheduler.next_pair(row.subject, row.difficulty)
+                ctx, result = await run_job(
+                    [SUBJECT_REGISTRARS[row.subject], reg_validator],
+                    topic=" and ".join(topics),
+                    constraints=self._constraints(row, topics),
+                    budget=self.budget,
+                    timeout_s=self.timeout_s,
+                    journal=self.journal,
+                )
+            result = result or {}
+            items = result.get("items") or []
+            if topics is not None:
+                self.scheduler.record(row.subject, topics, row.difficulty, *verdicts(result))
+        finally:
+            row.inflight -= 1
+            if _outage(result):
+                row.outages += 1
+            else:
+                row.attempts += 1
+            if topics is not None:
+                self.scheduler.release(row.subject, topics, row.difficulty)
+        self.jobs += 1
+        self.calls += int((result.get("cost") or {}).get("calls") or 0)
+        if not result:
+            return  # timed out: left pending in the journal and resumed on the next run
+        save_ctx = result.get("ctx") or (ctx.to_dict() if ctx else {})
+        items = items[: max(0, row.count - row.done)]
+        if items:
+            paths = await asyncio.to_thread(save_items, save_ctx, items, base_dir=self.base_dir,
+                                            passages=result.get("passages"))
+            row.done += len(items)
+            self.accepted += len(items)
+            if not self.quiet:
+                self._clear_progress()
+                print(f"VALIDATED: {len(items)} items")
+                for p in paths:
+                    print(f"saved: {p}")
+        if self.journal is not None:
+            # Only now is the job complete; a crash before this replays its items.validated
+            await asyncio.to_thread(self.journal.mark_saved, save_ctx)
+
+    async def _worker(self) -> None:
+        while True:
+            breaker = breaker_for(default_model())
+            state = breaker.state
+            # Open: wait out the cooldown. Half-open: one job probes the upstream while the rest wait
+            if state == "open" or (state == "half_open" and self._probing):
+                await asyncio.sleep(max(1.0, breaker.retry_after()))
+                continue
+            row, replay = self._next()
+            if row is None:
+                if any(r.inflight for r in self.rows):
+                    await asyncio.sleep(0.2)  # in-flight jobs may still fall short of quota
+                    continue
+                return
+            if state == "half_open":
+                self._probing = True
+            try:
+                await self._run_one(row, replay)
+            finally:
+                if state == "half_open":
+                    self._probing = False
+
+    def _clear_progress(self) -> None:
+        if sys.stderr.isatty():
+            sys.stderr.write("\r\033[K")
+
+    def progress_line(self) -> str:
+        elapsed = max(1e-6, time.monotonic() - self.started)
+        rate = self.accepted / elapsed * 60
+        remaining = max(0, self.target - self.accepted)
+        eta = f"{remaining / (rate / 60):.0f}s" if rate > 0 else "--"
+        lag = loop_lag.stats()
+        return (f"{self.accepted}/{self.target} items | {self.jobs} jobs | {self.calls} calls"
+                f" | {rate:.1f} items/min | ETA {eta} | loop lag p95 {lag['p95_ms']:.0f}ms")
+
+    async def _reporter(self) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            if sys.stderr.isatty():
+                sys.stderr.write("\r\033[K" + self.progress_line())
+            else:
+                sys.stderr.write(self.progress_line() + "\n")
+            sys.stderr.flush()
+
+    async def run(self) -> None:
+        await self.prepare()
+        loop_lag.start()
+        reporter = asyncio.create_task(self._reporter()) if not self.quiet else None
+        try:
+            await asyncio.gather(*(self._worker() for _ in range(self.concurrency)))
+        finally:
+            loop_lag.stop()
+            if reporter is not None:
+                reporter.cancel()
+        self._clear_progress()
+        print(self.progress_line(), file=sys.stderr)
+        for row in self.rows:
+            status = "done" if row.done >= row.count else (f"failed: {row.error}" if row.error else "short")
+            print(f"{row.key}: {row.done}/{row.count} ({status})")
+
+
+def _demo_rows() -> List[ManifestRow]:
+    stamp = str(int(time.time()))
+    return [ManifestRow(subject=s, difficulty=2, count=1, key=f"demo-{s}-{stamp}") for s in ("thinking", "math", "english")]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate Year 6 MCQs in-process.")
+    parser.add_argument("--manifest", help="CSV or JSONL manifest of (subject, difficulty, count, ...) rows")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BULK_CONCURRENCY", "4")))
+    parser.add_argument("--out", default="questions", help="output directory (default: questions)")
+    parser.add_argument("--journal", help="write-ahead journal path; unfinished jobs are resumed from it")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-job timeout in seconds")
+    parser.add_argument("--max-calls", type=int, default=12, help="Gemini call budget per job")
+    parser.add_argument("--scheduler-state", default=os.getenv("SCHEDULER_STATE_PATH"),
+                        help="persist topic coverage counts across runs")
+    args = parser.parse_args(argv)
+
+    rows = load_manifest(args.manifest) if args.manifest else _demo_rows()
+    runner = BulkRunner(
+        rows,
+        concurrency=args.concurrency,
+        base_dir=args.out,
+        journal=EventJournal(args.journal) if args.journal else None,
+        timeout_s=args.timeout,
+        max_calls=args.max_calls,
+        scheduler=CoverageScheduler(state_path=args.scheduler_state or None),
+    )
+    asyncio.run(runner.run())
+    return 0 if all(r.done >= r.count for r in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
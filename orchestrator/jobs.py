@@ -1,12 +1,70 @@
 from __future__ import annotations
-from typing import Optional, Dict
+import asyncio
+import contextlib
+from typing import Callable, Dict, List, Optional, Tuple
+from shared.budget import release_ledger
 from shared.schemas import JobContext
-from orchestrator.router import Router
+from orchestrator.router import EventJournal, Router
 
+EVENT_DONE = "items.validated"
 
-async def start_job(router: Router, topic: str, constraints: Optional[Dict] = None) -> JobContext:
+
+async def start_job(router: Router, topic: str, constraints: Optional[Dict] = None,
+                    budget: Optional[Dict] = None) -> JobContext:
     ctx = JobContext.new()
     if constraints:
         ctx.constraints.update(constraints)
+    if budget:
+        ctx.budget.update(budget)
     await router.emit("topic.received", {"ctx": ctx.to_dict(), "topic": topic})
-    return ctx
\ No newline at end of file
+    return ctx
+
+
+async def run_job(registrars: List[Callable[[Router], None]], topic: str = "", constraints: Optional[Dict] = None,
+                  budget: Optional[Dict] = None, timeout_s: float = 30.0, journal: Optional[EventJournal] = None,
+                  replay: Optional[List[Tuple[str, dict]]] = None) -> Tuple[Optional[JobContext], Optional[Dict]]:
+    """Run one job on a private router and return (ctx, first items.validated payload or None on timeout).
+
+    With ``replay`` the given (already journaled) events are re-dispatched instead of starting a new job;
+    each replay is counted in the journal, and a job none of whose events has a handler is abandoned.
+    Handlers still running when this returns are cancelled, so a timed-out job stops spending.
+    """
+    router = Router(journal)
+    for register in registrars:
+        register(router)
+    result: Dict = {}
+    done = asyncio.Event()
+
+    async def sink(msg: dict) -> None:
+        if not done.is_set():
+            result.update(msg)
+            done.set()
+
+    router.subscribe(EVENT_DONE, sink)
+    loop_task = asyncio.create_task(router.run())
+    ctx: Optional[JobContext] = None
+    try:
+        if replay:
+            ctx = JobContext(**replay[0][1]["ctx"])  # type: ignore[arg-type]
+            events = [(event, payload) for event, payload in replay if router.consumes(event)]
+            if journal is not None:
+                if not events:
+                    # e.g. journaled by an older version at a stage no handler picks up: it would replay forever
+                    await asyncio.to_thread(journal.mark_abandoned, ctx.to_dict(), "no handler for its last stage")
+                    return ctx, None
+                await asyncio.to_thread(journal.mark_replayed, ctx.to_dict())
+            for event, payload in events:
+                await router.requeue(event, payload)
+        else:
+            ctx = await start_job(router, topic=topic, constraints=constraints, budget=budget)
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(done.wait(), timeout=timeout_s)
+    finally:
+        loop_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await loop_task
+        await router.cancel_handlers()
+        if ctx is not None:
+            # Spend is reported in the result's cost; the ledger is not needed past this point
+            release_ledger(ctx.job_id)
+    return ctx, (result or None)
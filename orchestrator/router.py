@@ -1,23 +1,188 @@
 import asyncio
+import json
+import os
+import threading
+import time
 from collections import defaultdict
-from typing import Callable, Awaitable, Dict, List, Tuple
+from typing import Callable, Awaitable, Dict, List, Optional, Set, Tuple
 
 Handler = Callable[[dict], Awaitable[None]]
 
+# Written by the consumer once the job's items are durably saved (see EventJournal.mark_saved)
+SAVED_EVENT = "job.saved"
+# Written when a job is given up on (see EventJournal.mark_abandoned / abandon_stale)
+ABANDONED_EVENT = "job.abandoned"
+TERMINAL_EVENTS = {SAVED_EVENT, ABANDONED_EVENT}
+# Bookkeeping: one per replay attempt, counted against EventJournal.max_replays
+REPLAYED_EVENT = "job.replayed"
+
+
+def _stage_rank(event: str) -> int:
+    # Pipeline order used to find the last completed stage of a job; -1 = not replayable
+    if event == "topic.received":
+        return 0
+    if event.startswith("skill.plan"):
+        return 1
+    if event in TERMINAL_EVENTS:
+        return 4
+    if event == "items.validated":
+        return 3  # validated but maybe not saved yet: replayed straight to the consumer
+    if event.startswith("items."):
+        return 2
+    return -1
+
+
+def _job_id(payload: dict) -> Optional[str]:
+    ctx = payload.get("ctx") if isinstance(payload, dict) else None
+    return ctx.get("job_id") if isinstance(ctx, dict) else None
+
+
+class EventJournal:
+    """Append-only JSONL write-ahead log of router events, keyed by job_id.
+
+    Jobs whose items were saved (``mark_saved``) or that were given up on (``mark_abandoned``)
+    are dropped on compaction; unfinished jobs are replayed from their furthest stage so paid
+    plan/generate work is not redone, at most ``max_replays`` times (see ``abandon_stale``).
+    Methods do blocking file I/O and are thread-safe: call them via ``asyncio.to_thread``.
+    """
+
+    def __init__(self, path: str, fsync: bool = False, compact_every: int = 100, max_replays: int = 3) -> None:
+        self.path = path
+        self.fsync = fsync
+        self.compact_every = compact_every
+        self.max_replays = max_replays
+        self._completed_since_compact = 0
+        self._lock = threading.RLock()  # appends must not interleave with a compaction rewrite
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def append(self, event: str, payload: dict) -> bool:
+        job_id = _job_id(payload)
+        if job_id is None or (_stage_rank(event) < 0 and event != REPLAYED_EVENT):
+            return False
+        try:
+            line = json.dumps({"ts": time.time(), "job_id": job_id, "event": event, "payload": payload},
+                              ensure_ascii=False, separators=(",", ":"))
+        except (TypeError, ValueError):
+            return False  # e.g. raw image bytes: not journaled, the job restarts from its topic
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            if event in TERMINAL_EVENTS:
+                self._completed_since_compact += 1
+                if self.compact_every and self._completed_since_compact >= self.compact_every:
+                    self.compact()
+        return True
+
+    def mark_saved(self, ctx: dict) -> bool:
+        """Record that the job's validated items are persisted; only then is the job complete."""
+        return self.append(SAVED_EVENT, {"ctx": {"job_id": ctx.get("job_id")}})
+
+    def mark_abandoned(self, ctx: dict, reason: str) -> bool:
+        """Give up on the job: it is never replayed again and is dropped on compaction."""
+        return self.append(ABANDONED_EVENT, {"ctx": {"job_id": ctx.get("job_id")}, "reason": reason})
+
+    def mark_replayed(self, ctx: dict) -> bool:
+        return self.append(REPLAYED_EVENT, {"ctx": {"job_id": ctx.get("job_id")}})
+
+    def _read(self) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+        records: List[dict] = []
+        with self._lock, open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # torn final write after a crash
+        return records
+
+    def _scan(self) -> Tuple[Dict[str, List[Tuple[str, dict]]], Dict[str, int]]:
+        by_job: Dict[str, List[dict]] = defaultdict(list)
+        for rec in self._read():
+            by_job[rec["job_id"]].append(rec)
+        pending: Dict[str, List[Tuple[str, dict]]] = {}
+        replays: Dict[str, int] = {}
+        for job_id, recs in by_job.items():
+            if any(r["event"] in TERMINAL_EVENTS for r in recs):
+                continue
+            top = max(_stage_rank(r["event"]) for r in recs)
+            if top < 0:
+                continue
+            pending[job_id] = [(r["event"], r["payload"]) for r in recs if _stage_rank(r["event"]) == top]
+            replays[job_id] = sum(1 for r in recs if r["event"] == REPLAYED_EVENT)
+        return pending, replays
+
+    def pending(self) -> Dict[str, List[Tuple[str, dict]]]:
+        """Unfinished jobs -> events at their furthest stage (several for multi-subject fan-out)."""
+        return self._scan()[0]
+
+    def abandon_stale(self) -> List[str]:
+        """Mark unfinished jobs already replayed ``max_replays`` times abandoned; returns their ids."""
+        with self._lock:
+            _, replays = self._scan()
+            stale = [job_id for job_id, n in replays.items() if n >= self.max_replays]
+            for job_id in stale:
+                self.mark_abandoned({"job_id": job_id}, f"gave up after {replays[job_id]} replays")
+        return stale
+
+    def compact(self) -> None:
+        """Rewrite the log keeping only the furthest-stage events (and replay count) of unfinished jobs."""
+        with self._lock:
+            pending, replays = self._scan()
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for job_id, events in pending.items():
+                    records = events + [(REPLAYED_EVENT, {"ctx": {"job_id": job_id}})] * replays[job_id]
+                    for event, payload in records:
+                        f.write(json.dumps({"ts": time.time(), "job_id": job_id, "event": event, "payload": payload},
+                                           ensure_ascii=False, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self._completed_since_compact = 0
+
 
 class Router:
-    def __init__(self) -> None:
+    def __init__(self, journal: Optional[EventJournal] = None) -> None:
         self._subs: Dict[str, List[Handler]] = defaultdict(list)
         self._q: asyncio.Queue[Tuple[str, dict]] = asyncio.Queue()
+        self._journal = journal
+        self._tasks: Set[asyncio.Task] = set()
 
     def subscribe(self, event: str, handler: Handler) -> None:
         self._subs[event].append(handler)
 
+    def consumes(self, event: str) -> bool:
+        return bool(self._subs.get(event))
+
     async def emit(self, event: str, payload: dict) -> None:
+        if self._journal is not None and self.consumes(event):
+            # Written before dispatch (write-ahead), but off the event loop. Events nobody
+            # consumes (e.g. thinking's generic skill.plan) are not journaled: they can't be resumed from
+            await asyncio.to_thread(self._journal.append, event, payload)
+        await self._q.put((event, payload))
+
+    async def requeue(self, event: str, payload: dict) -> None:
+        """Dispatch an event that is already journaled (used for replay)."""
         await self._q.put((event, payload))
 
     async def run(self) -> None:
         while True:
             event, payload = await self._q.get()
             for h in self._subs.get(event, []):
-                asyncio.create_task(h(payload))
\ No newline at end of file
+                task = asyncio.create_task(h(payload))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def cancel_handlers(self) -> None:
+        """Cancel handlers still running (e.g. after a job timed out) and wait for them to unwind."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
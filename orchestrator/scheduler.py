@@ -0,0 +1,217 @@
+from __future__ import annotations
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from shared.topics import MATH_TOPICS, THINKING_TOPICS, ENGLISH_TOPICS
+
+Pair = Tuple[str, str]
+
+DIFFICULTIES = (1, 2, 3)
+SUBJECT_POOLS: Dict[str, List[str]] = {
+    "math": MATH_TOPICS,
+    "thinking": THINKING_TOPICS,
+    "english": ENGLISH_TOPICS,
+}
+
+
+# A poor-yield cell is skipped for this long after its last try, then retried
+BAN_COOLDOWN_S = float(os.getenv("SCHEDULER_BAN_COOLDOWN_S", "3600"))
+
+
+def verdicts(result: Optional[Dict[str, Any]]) -> Tuple[int, int]:
+    """Return (judged, accepted) item counts from a job result, counting only real validator verdicts.
+
+    Timed-out jobs (``None``), jobs that errored before validation and items failed as
+    ``unvalidated`` (budget, outage, missing report) say nothing about the topic pair.
+    """
+    if not result:
+        return 0, 0
+    accepted = len(result.get("items") or [])
+    rejected = sum(1 for f in result.get("failed") or [] if not f.get("unvalidated"))
+    return accepted + rejected, accepted
+
+
+@dataclass
+class CellStats:
+    generated: int = 0
+    accepted: int = 0
+    last_tried: float = 0.0  # wall-clock time of the last recorded verdict
+
+    def pass_rate(self) -> float:
+        # Laplace-smoothed so untried cells start at 0.5 instead of 0 or 1
+        return (self.accepted + 1) / (self.generated + 2)
+
+
+class CoverageScheduler:
+    """Pick the next (topic pair, difficulty) per subject to fill coverage quotas.
+
+    Tracks generated/accepted counts for every cell and skips pairs whose pass
+    rate stays below ``min_pass_rate`` after ``min_trials`` generated items, until
+    ``ban_cooldown_s`` after their last try; a retried pair's old counts are halved.
+    Picks still in flight (``reserve``/``release``) count against a cell's deficit,
+    and a UCB-style bonus keeps rarely tried cells competitive with early winners.
+    """
+
+    def __init__(self, pools: Optional[Dict[str, List[str]]] = None, quota: int = 5,
+                 min_pass_rate: float = 0.3, min_trials: int = 4, explore: float = 1.0,
+                 state_path: Optional[str] = None, ban_cooldown_s: float = BAN_COOLDOWN_S) -> None:
+        self.pools = pools or SUBJECT_POOLS
+        self.quota = quota
+        self.min_pass_rate = min_pass_rate
+        self.min_trials = min_trials
+        self.explore = explore
+        self.state_path = state_path
+        self.ban_cooldown_s = ban_cooldown_s
+        self._cells: Dict[str, Dict[Tuple[Pair, int], CellStats]] = {s: {} for s in self.pools}
+        self._pending: Dict[str, Dict[Tuple[Pair, int], int]] = {s: {} for s in self.pools}
+        self._save_lock = threading.Lock()
+        self._save_seq = 0
+        self._saved_seq = 0
+        self._load()
+
+    @staticmethod
+    def _norm(pair: Pair) -> Pair:
+        a, b = pair
+        return (a, b) if a <= b else (b, a)
+
+    def _pairs(self, subject: str) -> List[Pair]:
+        pool = sorted(set(self.pools.get(subject, [])))
+        return list(itertools.combinations(pool, 2))
+
+    def stats(self, subject: str, pair: Pair, difficulty: int) -> CellStats:
+        cells = self._cells.setdefault(subject, {})
+        return cells.setdefault((self._norm(pair), int(difficulty)), CellStats())
+
+    def _poor_yield(self, st: CellStats) -> bool:
+        return st.generated >= self.min_trials and st.pass_rate() < self.min_pass_rate
+
+    def _banned(self, st: CellStats) -> bool:
+        return self._poor_yield(st) and time.time() - st.last_tried < self.ban_cooldown_s
+
+    def pending(self, subject: str, pair: Pair, difficulty: int) -> int:
+        return self._pending.get(subject, {}).get((self._norm(pair), int(difficulty)), 0)
+
+    def reserve(self, subject: str, pair: Pair, difficulty: int) -> None:
+        """Mark a pick as in flight until ``release``; it counts against the cell's deficit."""
+        cells = self._pending.setdefault(subject, {})
+        key = (self._norm(pair), int(difficulty))
+        cells[key] = cells.get(key, 0) + 1
+
+    def release(self, subject: str, pair: Pair, difficulty: int) -> None:
+        cells = self._pending.setdefault(subject, {})
+        key = (self._norm(pair), int(difficulty))
+        left = cells.get(key, 0) - 1
+        if left > 0:
+            cells[key] = left
+        else:
+            cells.pop(key, None)
+
+    def next_cell(self, subject: str, difficulty: Optional[int] = None) -> Tuple[Pair, int]:
+        """Return the (pair, difficulty) with the largest optimistic quota fill per call."""
+        difficulties = [int(difficulty)] if difficulty is not None else list(DIFFICULTIES)
+        cells = [(pair, d) for pair in self._pairs(subject) for d in difficulties]
+        if not cells:
+            raise ValueError(f"no topics configured for subject {subject!r}")
+        tries = {c: self.stats(subject, *c).generated + self.pending(subject, *c) for c in cells}
+        log_total = math.log(sum(tries.values()) + 1)
+        candidates: List[Tuple[float, float, Pair, int]] = []
+        for pair, d in cells:
+            st = self.stats(subject, pair, d)
+            if self._banned(st):
+                continue
+            deficit = max(0, self.quota - st.accepted - self.pending(subject, pair, d))
+            # Pass rate plus an exploration bonus that shrinks as the cell is tried; jitter breaks ties
+            optimistic = min(1.0, st.pass_rate() + self.explore * math.sqrt(log_total / (tries[(pair, d)] + 1)))
+            candidates.append((deficit * optimistic, random.random(), pair, d))
+        if not candidates:
+            # Everything is banned: fall back to the best pass rate so we still make progress
+            candidates = [(self.stats(subject, p, d).pass_rate(), random.random(), p, d) for p, d in cells]
+        best_score = max(c[0] for c in candidates)
+        if best_score <= 0:
+            # All quotas met or in flight: keep spreading by least-covered cells
+            candidates = [(-(self.stats(subject, p, d).accepted + self.pending(subject, p, d)), j, p, d)
+                          for (_, j, p, d) in candidates]
+        _, _, pair, d = max(candidates)
+        return pair, d
+
+    def next_pair(self, subject: str, difficulty: int) -> Pair:
+        """Pick and ``reserve`` a pair; the caller must ``release`` it once the job has finished."""
+        pair, _ = self.next_cell(subject, difficulty)
+        self.reserve(subject, pair, difficulty)
+        # Randomise order so prompts don't always lead with the same topic
+        return pair if random.random() < 0.5 else (pair[1], pair[0])
+
+    def record(self, subject: str, pair: Pair, difficulty: int, generated: int, accepted: int) -> None:
+        """Add validator verdicts for a cell; pass counts from ``verdicts`` and skip jobs with none."""
+        if generated <= 0:
+            return
+        st = self.stats(subject, pair, difficulty)
+        if self._poor_yield(st) and not self._banned(st):
+            # Retried after its cooldown: let the new verdicts outweigh the ones that banned it
+            st.generated //= 2
+            st.accepted = min(st.accepted // 2, st.generated)
+        st.generated += int(generated)
+        st.accepted += max(0, min(int(accepted), int(generated)))
+        st.last_tried = time.time()
+        self._save()
+
+    def coverage(self, subject: str) -> Dict[str, Dict]:
+        return {
+            f"{a} + {b} @ {d}": {"generated": st.generated, "accepted": st.accepted,
+                                 "pass_rate": round(st.pass_rate(), 3), "banned": self._banned(st)}
+            for ((a, b), d), st in sorted(self._cells.get(subject, {}).items())
+            if st.generated
+        }
+
+    def _load(self) -> None:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        for subject, rows in (raw or {}).items():
+            for row in rows:
+                st = self.stats(subject, (row["a"], row["b"]), row["difficulty"])
+                st.generated = int(row.get("generated", 0))
+                st.accepted = int(row.get("accepted", 0))
+                st.last_tried = float(row.get("last_tried", 0.0))
+
+    def _save(self) -> None:
+        """Persist a snapshot; inside an event loop the file write runs in a worker thread."""
+        if not self.state_path:
+            return
+        out = {
+            subject: [
+                {"a": a, "b": b, "difficulty": d, **asdict(st)}
+                for ((a, b), d), st in cells.items() if st.generated
+            ]
+            for subject, cells in self._cells.items()
+        }
+        self._save_seq += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._save_seq, out)
+            return
+        loop.run_in_executor(None, self._write, self._save_seq, out)
+
+    def _write(self, seq: int, out: Dict) -> None:
+        with self._save_lock:
+            if seq < self._saved_seq:
+                return  # a newer snapshot already landed
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp = self.state_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(out, f, ensure_ascii=False)
+            os.replace(tmp, self.state_path)
+            self._saved_seq = seq
@@ -0,0 +1,91 @@
+from __future__ import annotations
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+from shared.schemas import JobContext
+
+# Recognised JobContext.budget keys; missing keys are unlimited
+BUDGET_KEYS = ("max_calls", "max_input_tokens", "max_output_tokens", "max_wall_s")
+_MAX_LEDGERS = 1024
+
+
+@dataclass
+class BudgetLedger:
+    """Running spend for one job, checked against its JobContext.budget limits."""
+
+    job_id: str
+    limits: Dict[str, float] = field(default_factory=dict)
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    def wall_s(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def _used(self) -> Dict[str, float]:
+        return {
+            "max_calls": self.calls,
+            "max_input_tokens": self.input_tokens,
+            "max_output_tokens": self.output_tokens,
+            "max_wall_s": self.wall_s(),
+        }
+
+    def remaining(self) -> Dict[str, float]:
+        used = self._used()
+        return {k: max(0.0, float(v) - used[k]) for k, v in self.limits.items() if k in used}
+
+    def exhausted(self) -> bool:
+        used = self._used()
+        return any(used[k] >= float(v) for k, v in self.limits.items() if k in used)
+
+    def can_afford(self, calls: int = 1) -> bool:
+        """True if ``calls`` more Gemini calls fit in the budget (use before retries/hedges)."""
+        if self.exhausted():
+            return False
+        limit = self.limits.get("max_calls")
+        return limit is None or self.calls + calls <= float(limit)
+
+    def charge(self, usage: Optional[Dict[str, Any]]) -> None:
+        """Record one call and its usageMetadata token counts."""
+        self.calls += 1
+        if not isinstance(usage, dict):
+            return
+        self.input_tokens += int(usage.get("promptTokenCount") or 0)
+        self.output_tokens += int(usage.get("candidatesTokenCount") or 0) + int(usage.get("thoughtsTokenCount") or 0)
+        self.cached_tokens += int(usage.get("cachedContentTokenCount") or 0)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+            "wall_s": round(self.wall_s(), 3),
+            "budget": dict(self.limits),
+            "exhausted": self.exhausted(),
+        }
+
+
+_ledgers: "OrderedDict[str, BudgetLedger]" = OrderedDict()
+
+
+def ledger_for(ctx: JobContext) -> BudgetLedger:
+    """Shared ledger for ctx.job_id (handlers each rebuild JobContext, so spend can't live on it)."""
+    ledger = _ledgers.get(ctx.job_id)
+    if ledger is None:
+        limits = {k: float(v) for k, v in (ctx.budget or {}).items() if k in BUDGET_KEYS and v is not None}
+        ledger = BudgetLedger(job_id=ctx.job_id, limits=limits)
+        _ledgers[ctx.job_id] = ledger
+        while len(_ledgers) > _MAX_LEDGERS:
+            _ledgers.popitem(last=False)
+    else:
+        _ledgers.move_to_end(ctx.job_id)
+    return ledger
+
+
+def release_ledger(job_id: str) -> Optional[BudgetLedger]:
+    return _ledgers.pop(job_id, None)
@@ -0,0 +1,104 @@
+from __future__ import annotations
+import asyncio
+import functools
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+log = logging.getLogger(__name__)
+
+# CPU-heavy pipeline steps (JSON decode, checks, serialization) leave the event loop above this size.
+# Pipeline payloads are typically 2-12 KB, so with the defaults nothing is offloaded: the threshold
+# only catches outliers. Thread mode also can't run pure-Python work such as json.loads beside the
+# loop (GIL); only process mode does, at a pickling cost that needs a lower threshold to pay off.
+_MODE = os.getenv("CPU_EXECUTOR", "thread").strip().lower()  # thread | process | inline
+_WORKERS = int(os.getenv("CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+_MIN_BYTES = int(os.getenv("CPU_OFFLOAD_MIN_BYTES", str(64 * 1024)))
+_ITEM_BYTES = 2048  # rough serialized size of one item/report, for offload decisions
+
+_LAG_INTERVAL_S = float(os.getenv("LOOP_LAG_INTERVAL_S", "0.25"))
+_LAG_WARN_S = float(os.getenv("LOOP_LAG_WARN_S", "0.1"))
+
+_executor: Optional[Executor] = None
+
+
+def get_executor() -> Optional[Executor]:
+    """Shared pool for offloaded work; None when CPU_EXECUTOR=inline."""
+    global _executor
+    if _executor is None and _MODE != "inline":
+        if _MODE == "process":
+            _executor = ProcessPoolExecutor(max_workers=_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=_WORKERS, thread_name_prefix="cpu")
+    return _executor
+
+
+def approx_size(obj: Any) -> int:
+    """O(1) size estimate used to decide whether to offload: byte length, or element count x _ITEM_BYTES.
+
+    Deliberately shallow so the decision itself never walks a large payload on the loop.
+    """
+    if isinstance(obj, (str, bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, (list, tuple, dict)):
+        return len(obj) * _ITEM_BYTES
+    return 0
+
+
+async def run_cpu(fn: Callable[..., T], *args: Any, size: int = 0, **kwargs: Any) -> T:
+    """Run ``fn`` inline when small, else in the configured pool (``fn`` must be picklable for processes)."""
+    executor = get_executor()
+    if executor is None or size < _MIN_BYTES:
+        return fn(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic timer fires; sustained lag means something is blocking the loop."""
+
+    def __init__(self, interval_s: float = _LAG_INTERVAL_S, warn_s: float = _LAG_WARN_S, window: int = 240) -> None:
+        self.interval_s = interval_s
+        self.warn_s = warn_s
+        self._lags: Deque[float] = deque(maxlen=window)
+        self.max_lag_s = 0.0
+        self.stalls = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            lag = max(0.0, time.perf_counter() - start - self.interval_s)
+            self._lags.append(lag)
+            self.max_lag_s = max(self.max_lag_s, lag)
+            if lag >= self.warn_s:
+                self.stalls += 1
+                log.warning("event loop blocked for %.0f ms", lag * 1000)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, float]:
+        ordered = sorted(self._lags)
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] if ordered else 0.0
+        return {
+            "p95_ms": round(p95 * 1000, 1),
+            "max_ms": round(self.max_lag_s * 1000, 1),
+            "stalls": self.stalls,
+            "samples": len(ordered),
+        }
+
+
+loop_lag = LoopLagMonitor()
@@ -1,9 +1,17 @@
 from __future__ import annotations
+import asyncio
+import base64
 import json
 import os
-from typing import Any, Dict, Optional
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 import httpx
 from dotenv import load_dotenv
+from shared.executor import run_cpu
+from shared.resilience import DEFAULT_TIMEOUT_S, breaker_for, is_breaker_failure, latency
+
+if TYPE_CHECKING:
+    from shared.budget import BudgetLedger
 
 load_dotenv()
 
@@ -11,12 +19,16 @@ _GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 _DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
 _API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
 
-
 def _ensure_model_path(model: str) -> str:
     return model if model.startswith("models/") else f"models/{model}"
 
 
-def _build_request(prompt: str, system: Optional[str], temperature: float, max_tokens: int, top_p: Optional[float]) -> Dict[str, Any]:
+def default_model() -> str:
+    return _ensure_model_path(_DEFAULT_MODEL)
+
+
+def _build_request(prompt: str, system: Optional[str], temperature: float, max_tokens: int, top_p: Optional[float],
+                   context: Optional[str] = None, images: Optional[List[Tuple[str, bytes]]] = None) -> Dict[str, Any]:
     gen_cfg: Dict[str, Any] = {
         "temperature": temperature,
         "maxOutputTokens": max_tokens,
@@ -24,9 +36,16 @@ def _build_request(prompt: str, system: Optional[str], temperature: float, max_t
     }
     if top_p is not None:
         gen_cfg["topP"] = top_p
+    parts: List[Dict[str, Any]] = [
+        {"inlineData": {"mimeType": mime, "data": base64.b64encode(data).decode("ascii")}}
+        for mime, data in (images or [])
+    ]
+    parts.append({"text": prompt})
+    if context:
+        parts.insert(0, {"text": context})
     req: Dict[str, Any] = {
         "contents": [
-            {"role": "user", "parts": [{"text": prompt}]}
+            {"role": "user", "parts": parts}
         ],
         "generationConfig": gen_cfg,
     }
@@ -42,35 +61,104 @@ def _parse_text(response_obj: Dict[str, Any]) -> str:
         return json.dumps({"error": "no_text"})
 
 
+def _decode_response(raw: bytes) -> Tuple[Any, Dict[str, Any]]:
+    """Parse a generateContent body into (JSON result, usageMetadata); CPU-bound, may run in a pool."""
+    body = json.loads(raw)
+    usage = (body.get("usageMetadata") or {}) if isinstance(body, dict) else {}
+    text = _parse_text(body)
+    try:
+        return json.loads(text), usage
+    except json.JSONDecodeError:
+        start = text.find("{")
+        end = text.rfind("}")
+        if start != -1 and end != -1 and end > start:
+            try:
+                return json.loads(text[start:end+1]), usage
+            except Exception:
+                pass
+        return {"_error": {"status": 422, "message": "Non-JSON model output"}}, usage
+
+
 async def call_gemini_json_async(prompt: str, *, system: Optional[str] = None, model: Optional[str] = None,
                                  temperature: float = 0.4, max_output_tokens: int = 2048,
-                                 timeout_s: float = 30.0, top_p: Optional[float] = None) -> Dict[str, Any]:
+                                 timeout_s: Optional[float] = None, top_p: Optional[float] = None,
+                                 context: Optional[str] = None,
+                                 images: Optional[List[Tuple[str, bytes]]] = None,
+                                 stage: str = "default", ledger: Optional[BudgetLedger] = None) -> Dict[str, Any]:
+    """Call Gemini and parse a JSON response.
+
+    ``context`` is large shared input (e.g. a reading passage) sent ahead of ``prompt``.
+    ``images`` are (mime_type, bytes) pairs sent as inline data before the prompt.
+    The timeout adapts to rolling latency for (model, ``stage``), capped at ``timeout_s``;
+    timeouts are recorded at the deadline so it can grow again. While the model's circuit
+    breaker is open the call fails fast with status 503; the half-open probe runs at the cap.
+    With a ``ledger`` the call is refused (status 402) once the job budget is spent,
+    and otherwise charged with the response's usageMetadata.
+    """
     api_key = _GEMINI_API_KEY
     if not api_key:
         return {"_error": {"status": 401, "message": "Missing GEMINI_API_KEY"}}
+    if ledger is not None and not ledger.can_afford():
+        return {"_error": {"status": 402, "message": "job budget exhausted", "budget_exhausted": True}}
     model_name = _ensure_model_path(model or _DEFAULT_MODEL)
+    breaker = breaker_for(model_name)
+    if not breaker.allow():
+        return {"_error": {"status": 503, "message": "circuit open", "circuit_open": True,
+                           "retry_after": round(breaker.retry_after(), 1)}}
+    ceiling = timeout_s if timeout_s is not None else DEFAULT_TIMEOUT_S
+    # The half-open probe gets the full ceiling: a deadline learned before an outage may be too
+    # tight for the recovered upstream, and a probe that always times out never closes the breaker
+    deadline = ceiling if breaker.probing else latency.deadline(model_name, stage, ceiling=ceiling)
+    started = time.monotonic()
+    usage: Dict[str, Any] = {}
+    try:
+        result = await _generate_json(api_key, model_name, prompt, system, temperature, max_output_tokens,
+                                      deadline, top_p, context, images, usage)
+    except asyncio.CancelledError:
+        # Cancelled with its job: no verdict on the upstream, but free a half-open probe slot
+        breaker.release()
+        raise
+    if ledger is not None:
+        ledger.charge(usage)
+    err = result.get("_error") if isinstance(result, dict) else None
+    status = int(err.get("status") or 0) if isinstance(err, dict) else 200
+    if err and is_breaker_failure(status):
+        breaker.record_failure()
+        if err.get("timeout"):
+            # Censored sample: the call took at least the deadline. Without it the window holds
+            # only calls that beat a stale deadline and the deadline can never grow back
+            latency.observe(model_name, stage, deadline)
+    elif err and status != 422:
+        breaker.release()
+    else:
+        # Non-JSON output (422) still means the upstream answered in time
+        breaker.record_success()
+        latency.observe(model_name, stage, time.monotonic() - started)
+    return result
+
+
+async def _generate_json(api_key: str, model_name: str, prompt: str, system: Optional[str], temperature: float,
+                         max_output_tokens: int, timeout_s: float, top_p: Optional[float], context: Optional[str],
+                         images: Optional[List[Tuple[str, bytes]]],
+                         usage_out: Dict[str, Any]) -> Dict[str, Any]:
     url = f"{_API_BASE}/{model_name}:generateContent?key={api_key}"
-    payload = _build_request(prompt, system, temperature, max_output_tokens, top_p)
     try:
         async with httpx.AsyncClient(timeout=timeout_s) as client:
+            payload = _build_request(prompt, system, temperature, max_output_tokens, top_p,
+                                     context=context, images=images)
             resp = await client.post(url, json=payload)
             resp.raise_for_status()
-            text = _parse_text(resp.json())
-            try:
-                return json.loads(text)
-            except json.JSONDecodeError:
-                start = text.find("{")
-                end = text.rfind("}")
-                if start != -1 and end != -1 and end > start:
-                    try:
-                        return json.loads(text[start:end+1])
-                    except Exception:
-                        pass
-                return {"_error": {"status": 422, "message": "Non-JSON model output"}}
+            raw = resp.content
+            # Large responses are decoded off the event loop
+            result, usage = await run_cpu(_decode_response, raw, size=len(raw))
+            usage_out.update(usage)
+            return result
     except httpx.HTTPStatusError as e:
         status = e.response.status_code if e.response is not None else 0
         detail = e.response.text if e.response is not None else str(e)
         return {"_error": {"status": status, "message": detail}}
+    except httpx.TimeoutException as e:
+        return {"_error": {"status": 0, "message": str(e) or "timeout", "timeout": True}}
     except httpx.HTTPError as e:
         return {"_error": {"status": 0, "message": str(e)}}
     except Exception as e:
@@ -79,7 +167,6 @@ async def call_gemini_json_async(prompt: str, *, system: Optional[str] = None, m
 
 # Optional sync shim for compatibility (used nowhere by default)
 def call_gemini_json(prompt: str, **kwargs: Any) -> Dict[str, Any]:
-    import asyncio
     try:
         loop = asyncio.get_running_loop()
     except RuntimeError:
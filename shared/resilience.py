@@ -0,0 +1,143 @@
+from __future__ import annotations
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+_MIN_SAMPLES = int(os.getenv("GEMINI_LATENCY_MIN_SAMPLES", "20"))
+_WINDOW = int(os.getenv("GEMINI_LATENCY_WINDOW", "200"))
+_DEADLINE_PCTL = float(os.getenv("GEMINI_DEADLINE_PERCENTILE", "0.95"))
+_DEADLINE_FACTOR = float(os.getenv("GEMINI_DEADLINE_FACTOR", "2.0"))
+_DEADLINE_MIN_S = float(os.getenv("GEMINI_DEADLINE_MIN_S", "5.0"))
+DEFAULT_TIMEOUT_S = float(os.getenv("GEMINI_TIMEOUT_S", "30.0"))
+
+_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+_BREAKER_COOLDOWN_S = float(os.getenv("GEMINI_BREAKER_COOLDOWN_S", "30.0"))
+
+
+class LatencyTracker:
+    """Rolling per-(model, stage) latency window used to derive call deadlines."""
+
+    def __init__(self, window: int = _WINDOW, min_samples: int = _MIN_SAMPLES) -> None:
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+
+    def observe(self, model: str, stage: str, seconds: float) -> None:
+        self._samples.setdefault((model, stage), deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, model: str, stage: str, q: float) -> Optional[float]:
+        samples = self._samples.get((model, stage))
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        idx = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[idx]
+
+    def deadline(self, model: str, stage: str, ceiling: float = DEFAULT_TIMEOUT_S) -> float:
+        """p95 x factor, clamped to [min, ceiling]; the ceiling until enough samples exist."""
+        p = self.percentile(model, stage, _DEADLINE_PCTL)
+        if p is None:
+            return ceiling
+        return max(_DEADLINE_MIN_S, min(ceiling, p * _DEADLINE_FACTOR))
+
+    def snapshot(self) -> Dict[str, Dict]:
+        out: Dict[str, Dict] = {}
+        for (model, stage), samples in self._samples.items():
+            out[f"{model}:{stage}"] = {
+                "n": len(samples),
+                "p50": self.percentile(model, stage, 0.5),
+                "p95": self.percentile(model, stage, 0.95),
+                "deadline": self.deadline(model, stage),
+            }
+        return out
+
+
+class CircuitBreaker:
+    """Opens after ``threshold`` consecutive timeouts/5xx; half-opens after ``cooldown_s`` for one probe."""
+
+    def __init__(self, threshold: int = _BREAKER_THRESHOLD, cooldown_s: float = _BREAKER_COOLDOWN_S) -> None:
+        self.threshold = threshold
+        self.cooldown_s = cooldown_s
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_s:
+            return "half_open"
+        return "open"
+
+    @property
+    def probing(self) -> bool:
+        """True while the single half-open probe call is in flight."""
+        return self._probe_in_flight
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown_s - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probe_in_flight or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release(self) -> None:
+        # Call finished with a non-breaker error (e.g. 4xx): neither success nor failure
+        self._probe_in_flight = False
+
+
+latency = LatencyTracker()
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def breaker_for(model: str) -> CircuitBreaker:
+    return _breakers.setdefault(model, CircuitBreaker())
+
+
+def is_breaker_failure(status: int) -> bool:
+    # Timeouts/network errors surface as status 0; 429 is quota, not an outage
+    return status == 0 or status >= 500
+
+
+def workload_stage(stage: str, units: int) -> str:
+    """Latency bucket for a call producing ``units`` items: 1, 2, 3-4, 5-8, ... share a bucket.
+
+    Keeps multi-item calls (passage sets, batch validation) from being timed against
+    the p95 of single-item calls.
+    """
+    if units <= 1:
+        return stage
+    return f"{stage}:x{1 << (units - 1).bit_length()}"
+
+
+def pipeline_deadline(model: str, stages: Tuple[str, ...], ceiling: float) -> float:
+    """Overall request deadline: sum of adaptive per-stage deadlines, capped at ``ceiling``."""
+    return min(ceiling, sum(latency.deadline(model, stage) for stage in stages))
+
+
+def breaker_status() -> Dict[str, Dict]:
+    return {
+        model: {"state": b.state, "failures": b.failures, "retry_after": round(b.retry_after(), 1)}
+        for model, b in _breakers.items()
+    }
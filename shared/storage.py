@@ -1,8 +1,10 @@
 from __future__ import annotations
+import glob
 import json
 import os
+import random
 import time
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 SUBJECTS = {"math", "english", "thinking"}
 
@@ -13,8 +15,12 @@ def ensure_question_dirs(base_dir: str = "questions") -> None:
         os.makedirs(os.path.join(base_dir, sub), exist_ok=True)
 
 
-def save_items(ctx: Dict, items: List[Dict], base_dir: str = "questions") -> List[str]:
-    """Save items to subject-specific JSON files; return written paths."""
+def save_items(ctx: Dict, items: List[Dict], base_dir: str = "questions",
+               passages: Optional[List[Dict]] = None) -> List[str]:
+    """Save items to subject-specific JSON files; return written paths.
+
+    Passages referenced by items (via evidence_ids) are stored once alongside them.
+    """
     ensure_question_dirs(base_dir)
     written: List[str] = []
     # Group by subject
@@ -28,7 +34,52 @@ def save_items(ctx: Dict, items: List[Dict], base_dir: str = "questions") -> Lis
         subj_dir = subj if subj in SUBJECTS else "mixed"
         os.makedirs(os.path.join(base_dir, subj_dir), exist_ok=True)
         path = os.path.join(base_dir, subj_dir, f"{job_id}_{ts}.json")
+        doc: Dict = {"ctx": ctx, "items": group}
+        ev = {e for it in group for e in (it.get("evidence_ids") or [])}
+        group_passages = [p for p in (passages or []) if p.get("id") in ev]
+        if group_passages:
+            doc["passages"] = group_passages
         with open(path, "w", encoding="utf-8") as f:
-            json.dump({"ctx": ctx, "items": group}, f, ensure_ascii=False, indent=2)
+            json.dump(doc, f, ensure_ascii=False, indent=2)
         written.append(path)
-    return written 
\ No newline at end of file
+    return written
+
+
+def load_inventory(subject: str, difficulty: Optional[int] = None, limit: int = 1,
+                   base_dir: str = "questions") -> Tuple[List[Dict], List[Dict]]:
+    """Pick previously validated items (and their passages) from saved files, e.g. as an outage fallback."""
+    pool: List[Dict] = []
+    passages: Dict[str, Dict] = {}
+    for path in glob.glob(os.path.join(base_dir, subject, "*.json")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if not isinstance(doc, dict):
+            continue
+        for p in doc.get("passages") or []:
+            passages[str(p.get("id"))] = p
+        for it in doc.get("items") or []:
+            if difficulty is None or int(it.get("difficulty", 2)) == int(difficulty):
+                pool.append(it)
+    picked = random.sample(pool, k=min(limit, len(pool)))
+    ev = {e for it in picked for e in (it.get("evidence_ids") or [])}
+    return picked, [passages[e] for e in ev if e in passages]
+
+
+def count_saved(subject: str, manifest_key: str, base_dir: str = "questions") -> int:
+    """Count saved items whose job was tagged with ``manifest_key`` (ctx.constraints.manifest_key)."""
+    total = 0
+    subj_dir = subject if subject in SUBJECTS else "mixed"
+    for path in glob.glob(os.path.join(base_dir, subj_dir, "*.json")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        ctx = doc.get("ctx") if isinstance(doc, dict) else None
+        constraints = ctx.get("constraints") if isinstance(ctx, dict) else None
+        if isinstance(constraints, dict) and constraints.get("manifest_key") == manifest_key:
+            total += len(doc.get("items") or [])
+    return total
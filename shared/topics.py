@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import List
+import random
+from typing import List, Optional, Tuple
 
 # Year 6 selective-style topics per subject
 
@@ -42,4 +43,13 @@ ENGLISH_TOPICS: List[str] = [
     "tone and attitude",
     "text structure",
     "reference resolution",
-] 
\ No newline at end of file
+]
+
+
+def pick_topic_pair(constraints: Optional[dict], pool: List[str]) -> Tuple[str, str]:
+    """Use the scheduler-assigned pair from job constraints, else sample two topics at random."""
+    topics = constraints.get("topics") if isinstance(constraints, dict) else None
+    if isinstance(topics, (list, tuple)) and len(topics) >= 2:
+        return str(topics[0]), str(topics[1])
+    a, b = random.sample(pool, 2)
+    return a, b
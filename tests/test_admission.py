@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from api.app import AdmissionController
+
+
+async def _serve(ctrl, client, priority, order, name):
+    async with ctrl.slot(client, priority, deadline_s=100) as ticket:
+        ticket.sample = False
+        order.append(name)
+
+
+async def _queue_behind_holder(ctrl, requests):
+    """Occupy every slot, queue ``requests`` in order, then free the slots; returns the grant order."""
+    order, gate = [], asyncio.Event()
+
+    async def hold():
+        async with ctrl.slot("holder", "interactive", deadline_s=100) as ticket:
+            ticket.sample = False
+            await gate.wait()
+
+    holders = [asyncio.create_task(hold()) for _ in range(ctrl.concurrency)]
+    await asyncio.sleep(0)
+    tasks = []
+    for client, priority, name in requests:
+        tasks.append(asyncio.create_task(_serve(ctrl, client, priority, order, name)))
+        await asyncio.sleep(0)  # enqueue in the listed order
+    gate.set()
+    await asyncio.gather(*holders, *tasks)
+    return order
+
+
+def test_interactive_requests_are_served_before_bulk():
+    ctrl = AdmissionController(concurrency=1, bulk_reserve=0, initial_service_s=1.0)
+    order = asyncio.run(_queue_behind_holder(ctrl, [
+        ("a", "bulk", "bulk-1"),
+        ("b", "bulk", "bulk-2"),
+        ("c", "interactive", "interactive"),
+    ]))
+    assert order == ["interactive", "bulk-1", "bulk-2"]
+
+
+def test_clients_are_served_round_robin():
+    ctrl = AdmissionController(concurrency=1, bulk_reserve=0, initial_service_s=1.0)
+    order = asyncio.run(_queue_behind_holder(ctrl, [
+        ("a", "interactive", "a1"),
+        ("a", "interactive", "a2"),
+        ("a", "interactive", "a3"),
+        ("b", "interactive", "b1"),
+    ]))
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_bulk_reserve_keeps_a_slot_for_interactive():
+    async def run():
+        ctrl = AdmissionController(concurrency=2, bulk_reserve=1, initial_service_s=1.0)
+        gate = asyncio.Event()
+
+        async def hold_bulk():
+            async with ctrl.slot("a", "bulk", deadline_s=100):
+                await gate.wait()
+
+        held = asyncio.create_task(hold_bulk())
+        await asyncio.sleep(0)
+        assert ctrl.estimate_wait("bulk") > 0
+        assert ctrl.estimate_wait("interactive") == 0
+        async with ctrl.slot("b", "interactive", deadline_s=100):
+            assert ctrl.active == 2
+        gate.set()
+        await held
+
+    asyncio.run(run())
+
+
+def test_request_that_cannot_meet_its_deadline_is_rejected():
+    async def run():
+        ctrl = AdmissionController(concurrency=1, bulk_reserve=0, initial_service_s=5.0)
+        gate = asyncio.Event()
+
+        async def hold():
+            async with ctrl.slot("a", "interactive", deadline_s=100):
+                await gate.wait()
+
+        held = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as exc:
+            async with ctrl.slot("b", "interactive", deadline_s=6.0):
+                pass
+        assert exc.value.status_code == 503
+        assert "Retry-After" in exc.value.headers
+        gate.set()
+        await held
+
+    asyncio.run(run())
@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+from orchestrator.jobs import run_job
+from orchestrator.router import EventJournal, Router
+from shared.schemas import JobContext
+
+
+def _generator(calls):
+    def register(router: Router) -> None:
+        async def handle(msg: dict) -> None:
+            calls.append("generate")
+            await router.emit("skill.plan", {"ctx": msg["ctx"]})  # nobody consumes this
+            await router.emit("items.math", {"ctx": msg["ctx"], "items": [{"id": "q1"}]})
+
+        router.subscribe("topic.received", handle)
+    return register
+
+
+def _validator(calls):
+    def register(router: Router) -> None:
+        async def handle(msg: dict) -> None:
+            calls.append("validate")
+            await router.emit("items.validated", {"ctx": msg["ctx"], "items": msg["items"], "failed": []})
+
+        router.subscribe("items.math", handle)
+    return register
+
+
+def _hanging(router: Router) -> None:
+    async def handle(msg: dict) -> None:
+        await asyncio.sleep(3600)
+
+    router.subscribe("topic.received", handle)
+
+
+def _events(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["event"] for line in f if line.strip()]
+
+
+def test_compaction_keeps_only_the_furthest_stage_of_unfinished_jobs(tmp_path):
+    journal = EventJournal(str(tmp_path / "j.jsonl"))
+    unfinished, saved = JobContext.new().to_dict(), JobContext.new().to_dict()
+    journal.append("topic.received", {"ctx": unfinished, "topic": "t"})
+    journal.append("items.math", {"ctx": unfinished, "items": []})
+    journal.append("topic.received", {"ctx": saved, "topic": "t"})
+    journal.append("items.validated", {"ctx": saved, "items": []})
+    journal.mark_saved(saved)
+
+    journal.compact()
+
+    assert _events(journal.path) == ["items.math"]
+    assert list(journal.pending()) == [unfinished["job_id"]]
+
+
+def test_replay_resumes_from_the_furthest_stage(tmp_path):
+    journal = EventJournal(str(tmp_path / "j.jsonl"))
+    calls = []
+    ctx = JobContext.new().to_dict()
+    journal.append("topic.received", {"ctx": ctx, "topic": "t"})
+    journal.append("items.math", {"ctx": ctx, "items": [{"id": "q1"}]})
+
+    events = journal.pending()[ctx["job_id"]]
+    _, result = asyncio.run(run_job([_generator(calls), _validator(calls)], journal=journal,
+                                    timeout_s=5, replay=events))
+
+    assert calls == ["validate"]  # generation is not paid for twice
+    assert result["items"] == [{"id": "q1"}]
+    assert ctx["job_id"] in journal.pending()  # validated but not yet saved
+    journal.mark_saved(result["ctx"])
+    assert journal.pending() == {}
+
+
+def test_unconsumed_events_are_not_journaled(tmp_path):
+    journal = EventJournal(str(tmp_path / "j.jsonl"))
+    calls = []
+    asyncio.run(run_job([_generator(calls), _validator(calls)], topic="t", journal=journal, timeout_s=5))
+    assert "skill.plan" not in _events(journal.path)
+
+
+def test_replay_with_no_handler_for_its_stage_is_abandoned(tmp_path):
+    journal = EventJournal(str(tmp_path / "j.jsonl"))
+    ctx = JobContext.new().to_dict()
+    journal.append("skill.plan", {"ctx": ctx})  # written before unconsumed events were skipped
+
+    events = journal.pending()[ctx["job_id"]]
+    _, result = asyncio.run(run_job([_generator([])], journal=journal, timeout_s=5, replay=events))
+
+    assert result is None
+    assert journal.pending() == {}
+
+
+def test_jobs_that_keep_timing_out_are_abandoned(tmp_path):
+    journal = EventJournal(str(tmp_path / "j.jsonl"), max_replays=2)
+    ctx = JobContext.new().to_dict()
+    journal.append("topic.received", {"ctx": ctx, "topic": "t"})
+
+    for _ in range(2):
+        assert journal.abandon_stale() == []
+        journal.compact()  # replay counts survive compaction
+        events = journal.pending()[ctx["job_id"]]
+        _, result = asyncio.run(run_job([_hanging], journal=journal, timeout_s=0.05, replay=events))
+        assert result is None
+
+    assert journal.abandon_stale() == [ctx["job_id"]]
+    journal.compact()
+    assert journal.pending() == {}
+    assert _events(journal.path) == []
@@ -0,0 +1,44 @@
+import time
+
+from orchestrator.scheduler import CoverageScheduler, verdicts
+
+POOLS = {"math": ["a", "b", "c"]}
+
+
+def test_verdicts_ignore_timeouts_and_unvalidated_items():
+    assert verdicts(None) == (0, 0)
+    assert verdicts({"items": [], "failed": []}) == (0, 0)
+    result = {"items": [{"id": "1"}], "failed": [{"item_id": "2"}, {"item_id": "3", "unvalidated": True}]}
+    assert verdicts(result) == (2, 1)
+
+
+def test_jobs_without_verdicts_do_not_ban_a_pair():
+    sched = CoverageScheduler(pools=POOLS, min_trials=2)
+    for _ in range(10):
+        sched.record("math", ("a", "b"), 1, *verdicts(None))
+    assert sched.stats("math", ("a", "b"), 1).generated == 0
+    assert not sched._banned(sched.stats("math", ("a", "b"), 1))
+
+
+def test_banned_pair_is_retried_after_cooldown():
+    sched = CoverageScheduler(pools=POOLS, min_trials=2, ban_cooldown_s=60)
+    sched.record("math", ("a", "b"), 1, generated=4, accepted=0)
+    st = sched.stats("math", ("a", "b"), 1)
+    assert sched._banned(st)
+    assert all(sched.next_cell("math", 1)[0] != ("a", "b") for _ in range(20))
+
+    st.last_tried = time.time() - 61
+    assert not sched._banned(st)
+    sched.record("math", ("a", "b"), 1, generated=2, accepted=2)
+    # old counts halved before the new verdicts are added
+    assert (st.generated, st.accepted) == (4, 2)
+    assert not sched._poor_yield(st)
+
+
+def test_state_round_trips_last_tried(tmp_path):
+    path = str(tmp_path / "state.json")
+    sched = CoverageScheduler(pools=POOLS, state_path=path)
+    sched.record("math", ("b", "a"), 2, generated=3, accepted=1)
+    loaded = CoverageScheduler(pools=POOLS, state_path=path).stats("math", ("a", "b"), 2)
+    assert (loaded.generated, loaded.accepted) == (3, 1)
+    assert loaded.last_tried == sched.stats("math", ("a", "b"), 2).last_tried